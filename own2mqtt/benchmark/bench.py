@@ -0,0 +1,223 @@
+# Offline benchmark: runs OpenWebNet against a local fake gateway with an in-memory MQTT client.
+#
+#   python bench.py --frames 50000 --mix lights=4,shutters=2,thermo=2,energy=1 --commands 500
+#   python bench.py --engine asyncio --rate 2000 --json
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rootfs'))
+
+from fake_gateway import FakeGateway  # noqa: E402
+from openwebnet import OpenWebNet  # noqa: E402
+from openwebnet_async import OpenWebNetAsync  # noqa: E402
+
+
+class MQTTMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class RecordingMQTTClient:
+    def __init__(self, userdata):
+        self.userdata = userdata
+        self.lock = threading.Lock()
+        self.publish_count = 0
+        # topic -> [(perf_counter(), payload)] only for the topics the benchmark waits on
+        self.watched = {}
+        self.watched_prefixes = ()
+
+    def watch(self, *prefixes):
+        self.watched_prefixes = prefixes
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        now = time.perf_counter()
+        with self.lock:
+            self.publish_count += 1
+            if topic.startswith(self.watched_prefixes):
+                self.watched.setdefault(topic, []).append((now, payload))
+
+    def subscribe(self, *args, **kwargs):
+        pass
+
+    def message_callback_add(self, *args, **kwargs):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+def bench_class(engine):
+    base_class = OpenWebNetAsync if engine == 'asyncio' else OpenWebNet
+
+    class BenchOpenWebNet(base_class):
+        def mqtt_start(self):
+            userdata = {'base_topic': self.mqtt_base_topic, 'own_instance': self}
+            self.mqtt_client = RecordingMQTTClient(userdata)
+            self.mqtt_client.watch(f'{self.mqtt_base_topic}/who-18/', f'{self.mqtt_base_topic}/who-1/')
+            self.on_mqtt_connect(self.mqtt_client, userdata, {}, 0)
+
+    return BenchOpenWebNet
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {}
+    for name, share in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)):
+        result[name] = round(values[min(int(len(values) * share), len(values) - 1)] * 1000, 3)
+    return result
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def parse_mix(mix):
+    frame_mix = {}
+    for part in mix.split(','):
+        frame_type, weight = part.split('=')
+        frame_mix[frame_type] = int(weight)
+    return frame_mix
+
+
+def run_monitor(own_instance, gateway, timeout):
+    base_topic = own_instance.mqtt_base_topic
+    cpu_start = cpu_seconds()
+    gateway.monitor_started.wait(timeout)
+    client = own_instance.mqtt_client
+    start = time.perf_counter()
+    deadline = start + timeout
+    latencies = []
+    while time.perf_counter() < deadline:
+        time.sleep(0.01)
+        if not gateway.monitor_done.is_set():
+            continue
+        if not gateway.marker_sent:
+            break
+        with client.lock:
+            published = dict(client.watched)
+        received = {}
+        for topic, values in published.items():
+            if topic.startswith(f'{base_topic}/who-18/') and topic.endswith('/total_energy'):
+                for published_at, payload in values:
+                    received[int(payload)] = published_at
+        if max(gateway.marker_sent) in received:
+            latencies = [received[seq] - sent for seq, sent in gateway.marker_sent.items() if seq in received]
+            break
+    elapsed = time.perf_counter() - start
+    return {
+        'frames': gateway.frames,
+        'seconds': round(elapsed, 3),
+        'frames_per_second': round(gateway.frames / elapsed) if elapsed else 0,
+        'markers_published': len(latencies),
+        'markers_sent': len(gateway.marker_sent),
+        'frame_to_publish_ms': percentiles(latencies),
+        'cpu_seconds': round(cpu_seconds() - cpu_start, 3),
+    }
+
+
+def run_commands(own_instance, commands, timeout):
+    client = own_instance.mqtt_client
+    userdata = client.userdata
+    base_topic = own_instance.mqtt_base_topic
+    round_trips = []
+    for i in range(commands):
+        # Alternate the value so every ACK publish is a state change
+        where = 100 + i % 50
+        payload = b'ON' if (i // 50) % 2 == 0 else b'OFF'
+        topic = f'{base_topic}/who-1/{where}/state'
+        with client.lock:
+            seen = len(client.watched.get(topic, []))
+        sent_at = time.perf_counter()
+        own_instance.on_mqtt_message(client, userdata, MQTTMessage(f'{base_topic}/who-1/{where}/command', payload))
+        deadline = sent_at + timeout
+        while time.perf_counter() < deadline:
+            with client.lock:
+                values = client.watched.get(topic, [])
+                if len(values) > seen:
+                    round_trips.append(values[-1][0] - sent_at)
+                    break
+            time.sleep(0.0005)
+    return {
+        'commands': commands,
+        'acknowledged': len(round_trips),
+        'round_trip_ms': percentiles(round_trips),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='own2mqtt end-to-end benchmark')
+    parser.add_argument('--engine', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--rate', type=int, default=0, help='monitor frames/s, 0 streams as fast as possible')
+    parser.add_argument('--mix', default='lights=4,shutters=2,thermo=2,energy=1')
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--frames-per-second', type=int, default=0, help='outbound rate limit, 0 disables it')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.getLogger("own2mqtt").setLevel(args.log_level)
+    logging.basicConfig(stream=sys.stderr)
+
+    gateway = FakeGateway('12345', parse_mix(args.mix), args.frames, args.rate)
+    gateway.start()
+
+    options = {
+        'own_server_ip': gateway.address[0],
+        'own_server_port': gateway.address[1],
+        'own_server_password': '12345',
+        'mqtt_server_ip': '',
+        'mqtt_server_port': 1883,
+        'mqtt_server_user': '',
+        'mqtt_server_password': '',
+        'log_level': args.log_level,
+        'debug': False,
+        'mqtt_client_name': 'own2mqtt-bench',
+        'mqtt_base_topic': 'openwebnet',
+        'thermo_zones': [],
+        'f520_ids': [],
+        'f522_ids': [],
+        'query_interval': {'total_energy_query': 60},
+        'engine': args.engine,
+        'outbound': {'frames_per_second': args.frames_per_second, 'stats_interval': 0},
+    }
+    own_instance = bench_class(args.engine)(options)
+    threading.Thread(target=own_instance.run, name='own2mqtt', daemon=True).start()
+
+    report = {'engine': args.engine, 'mix': args.mix}
+    report['monitor'] = run_monitor(own_instance, gateway, args.timeout)
+    report['command'] = run_commands(own_instance, args.commands, 5)
+    report['mqtt_publishes'] = own_instance.mqtt_client.publish_count
+    report['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        monitor, command = report['monitor'], report['command']
+        print(f"engine {report['engine']}, mix {report['mix']}")
+        print(f"monitor: {monitor['frames']} frames in {monitor['seconds']} s = {monitor['frames_per_second']} frames/s, "
+              f"cpu {monitor['cpu_seconds']} s")
+        print(f"frame to publish ms: {monitor['frame_to_publish_ms']} ({monitor['markers_published']}/{monitor['markers_sent']} markers)")
+        print(f"command round trip ms: {command['round_trip_ms']} ({command['acknowledged']}/{command['commands']} acknowledged)")
+        print(f"mqtt publishes {report['mqtt_publishes']}, max rss {report['max_rss_kb']} kB")
+    sys.stdout.flush()
+    # The engine threads never return, leave without waiting for them
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import binascii
+import hashlib
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+
+from own_frame_reader import OWNFrameReader
+
+
+ACK = b'*#*1##'
+AUTH_START = b'*98*2##'
+SET_COMMAND = b'*99*0##'
+SET_MONITOR = b'*99*1##'
+A_HEX = '736F70653E'
+B_HEX = '636F70653E'
+
+
+def hex_to_decimal_string(h):
+    return ''.join('{0:02d}'.format(int(c, 16)) for c in h)
+
+
+def decimal_string_to_hex(s):
+    return ''.join(hex(int(s[i:i + 2]))[2:] for i in range(0, len(s), 2))
+
+
+def light_frame(i):
+    return f'*1*{i % 2}*{11 + i % 40}##'.encode()
+
+
+def shutter_frame(i):
+    return f'*#2*{41 + i % 10}*10*10*{i % 101}*0*0##'.encode()
+
+
+def thermo_frame(i):
+    return f'*#4*{1 + i % 8}*0*0{200 + i % 50}##'.encode()
+
+
+def energy_frame(i):
+    # Always a unique total_energy value, so these frames double as latency markers
+    return f'*#18*5{1 + i % 4}*51*{i}##'.encode()
+
+
+FRAME_TYPES = {
+    'lights': light_frame,
+    'shutters': shutter_frame,
+    'thermo': thermo_frame,
+    'energy': energy_frame,
+}
+
+
+class FakeGatewayConnection:
+    # One frame at a time from the TCP stream, frames sharing a read are kept for the next call
+    def __init__(self, connection):
+        self.connection = connection
+        self.reader = OWNFrameReader(connection)
+        self.frames = deque()
+
+    def read_frame(self):
+        if not self.frames:
+            self.frames.extend(frame.encode() for frame in self.reader.read_frames())
+        return self.frames.popleft()
+
+    def read_pending(self):
+        # Every frame already received, waits for at least one
+        if not self.frames:
+            self.frames.extend(frame.encode() for frame in self.reader.read_frames())
+        frames = list(self.frames)
+        self.frames.clear()
+        return frames
+
+
+class FakeGateway:
+    def __init__(self, password, frame_mix, frames, rate=0, batch=20, host='127.0.0.1', port=0):
+        self.password = password
+        self.frames = frames
+        self.rate = rate
+        self.batch = batch
+        self.frame_types = []
+        for frame_type, weight in frame_mix.items():
+            self.frame_types.extend([FRAME_TYPES[frame_type]] * weight)
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.server_socket.listen()
+        self.address = self.server_socket.getsockname()
+
+        # seq -> perf_counter() when the marker frame was written to the monitor session
+        self.marker_sent = {}
+        self.monitor_started = threading.Event()
+        self.monitor_done = threading.Event()
+        self.commands_received = 0
+
+    def start(self):
+        threading.Thread(target=self.__accept, name='fake-gateway', daemon=True).start()
+
+    def __accept(self):
+        while True:
+            connection, _ = self.server_socket.accept()
+            threading.Thread(target=self.__session, args=(connection,), daemon=True).start()
+
+    def __session(self, connection):
+        stream = FakeGatewayConnection(connection)
+        try:
+            connection.send(ACK)
+            session_frame = stream.read_frame()
+            connection.send(AUTH_START)
+            stream.read_frame()
+            if not self.__authenticate(stream):
+                connection.close()
+                return
+            if session_frame == SET_MONITOR:
+                self.__stream_monitor(connection)
+            elif session_frame == SET_COMMAND:
+                self.__serve_commands(stream)
+        except OSError:
+            connection.close()
+
+    def __authenticate(self, stream):
+        connection = stream.connection
+        ra_hex = binascii.hexlify(os.urandom(32)).decode()
+        connection.send(f'*#{hex_to_decimal_string(ra_hex)}##'.encode())
+        rb, client_digest = stream.read_frame().decode()[2:-2].split('*')
+        rb_hex = decimal_string_to_hex(rb)
+        kab_hex = hashlib.sha256(self.password.encode()).hexdigest()
+        expected = hashlib.sha256((ra_hex + rb_hex + A_HEX + B_HEX + kab_hex).encode()).hexdigest()
+        if decimal_string_to_hex(client_digest) != expected:
+            return False
+        server_digest = hashlib.sha256((ra_hex + rb_hex + kab_hex).encode()).hexdigest()
+        connection.send(f'*#{hex_to_decimal_string(server_digest)}##'.encode())
+        return stream.read_frame() == ACK
+
+    def __stream_monitor(self, connection):
+        if self.monitor_started.is_set():
+            # Only the first MONITOR session gets the frame stream
+            self.__idle(connection)
+            return
+        self.monitor_started.set()
+        interval = self.batch / self.rate if self.rate > 0 else 0
+        next_send = time.perf_counter()
+        for start in range(0, self.frames, self.batch):
+            chunk = []
+            for i in range(start, min(start + self.batch, self.frames)):
+                frame_type = self.frame_types[i % len(self.frame_types)]
+                chunk.append(frame_type(i))
+                if frame_type is energy_frame:
+                    self.marker_sent[i] = time.perf_counter()
+            connection.sendall(b''.join(chunk))
+            if interval:
+                next_send += interval
+                time.sleep(max(next_send - time.perf_counter(), 0))
+        self.monitor_done.set()
+        self.__idle(connection)
+
+    def __serve_commands(self, stream):
+        # Frames that arrived with the final handshake ACK are answered like any other
+        while True:
+            count = len(stream.read_pending())
+            self.commands_received += count
+            stream.connection.sendall(ACK * count)
+
+    @staticmethod
+    def __idle(connection):
+        # Keep the session alive with gateway chatter so the client liveness check does not trip
+        while True:
+            time.sleep(5)
+            connection.sendall(b'*#13**22*%d*0*0*0*1*1*1*2024##' % random.randint(0, 23))
@@ -1,5 +1,7 @@
 import binascii
+import functools
 import hashlib
+import json
 import logging
 import os
 import time
@@ -9,8 +11,27 @@ import socket
 import threading
 import paho.mqtt.client as mqtt
 
-from own_frame_command import OWNFrameCommand
+from own_backoff import OWNBackoff
+from own_bulk_command import BULK_COMMAND_TOPIC, OWNBulkCommand, command_groups
+from own_command_channel import OWNCommandChannel
+from own_command_pool import OWNCommandPool
+from own_device_inventory import OWNDeviceInventory
+from own_energy_aggregator import OWNEnergyAggregator
+from own_frame_capture import OWNFrameCaptureWriter
+from own_frame_command import OWNFrameCommand, command_routes
+from own_frame_filter import OWNFrameFilter
+from own_frame_tap import FRAME_TAP_DUMP_TOPIC, OWNFrameTap
 from own_frame_monitor import OWNFrameMonitor
+from own_frame_reader import OWNFrameReader
+from own_frame_scheduler import OWNFrameScheduler
+from own_metrics import OWNMetrics
+from own_monitor_pipeline import OWNMonitorPipeline
+from own_poller import OWNPoller
+from own_profiler import PROFILER_COMMAND_TOPIC, OWNProfiler
+from own_state_cache import OWNStateCache
+from own_state_journal import HISTORY_QUERY_TOPIC, OWNStateJournal
+from own_state_query import OWNStateQuery
+from own_state_snapshot import OWNStateSnapshot
 
 
 class OpenWebNet:
@@ -29,6 +50,10 @@ class OpenWebNet:
         self.KEEP_ALIVE = b'*#13**22##'
 
         self.mqtt_client = None
+        session = options.get('session', {})
+        self.session_keepalive_interval = session.get('keepalive_interval', 10)
+        self.session_connect_timeout = session.get('connect_timeout', 10)
+        self.session_max_backoff = session.get('max_backoff', 60)
         self.mqtt_server_ip = options['mqtt_server_ip']
         self.mqtt_server_port = options['mqtt_server_port']
         self.mqtt_client_name = options['mqtt_client_name']
@@ -36,167 +61,463 @@ class OpenWebNet:
         self.mqtt_server_password = options['mqtt_server_password']
         self.mqtt_base_topic = options['mqtt_base_topic']
 
+        self.metrics = OWNMetrics()
+        metrics = options.get('metrics', {})
+        self.metrics_http_port = metrics.get('http_port', 0)
+        self.metrics_mqtt_interval = metrics.get('mqtt_interval', 0)
+        self.last_monitor_frame = None
+
         self.thermo_zones = {}
         for thermo_zone in options['thermo_zones']:
             self.thermo_zones[str(thermo_zone)] = {}
         self.query_interval = options['query_interval']
-        self.f520_ids = options['f520_ids']
-        self.f522_ids = options['f522_ids']
+        self.query_interval_overrides = {}
+        for query_interval_override in options.get('query_interval_overrides', []):
+            job_name, interval = query_interval_override.split('=')
+            self.query_interval_overrides[job_name] = int(interval)
+        self.f520_ids = [str(f520_id) for f520_id in options['f520_ids']]
+        self.f522_ids = [str(f522_id) for f522_id in options['f522_ids']]
+        device_inventory = options.get('device_inventory', {})
+        self.device_inventory = None
+        if device_inventory.get('enabled', False):
+            self.device_inventory = OWNDeviceInventory(self, device_inventory.get('file', '/data/device_inventory.json'),
+                                                       device_inventory.get('frames_per_second', 5),
+                                                       device_inventory.get('rescan_hours', 24),
+                                                       device_inventory.get('full_scan_days', 7),
+                                                       device_inventory.get('forget_days', 30),
+                                                       device_inventory.get('max_thermo_zone', 99),
+                                                       device_inventory.get('max_f520_id', 16),
+                                                       device_inventory.get('max_f522_id', 16))
+            # Devices found by earlier runs are added to the configured ones
+            for thermo_zone in self.device_inventory.device_ids('thermo_zone'):
+                self.thermo_zones.setdefault(thermo_zone, {})
+            self.f520_ids += [f520_id for f520_id in self.device_inventory.device_ids('f520') if f520_id not in self.f520_ids]
+            self.f522_ids += [f522_id for f522_id in self.device_inventory.device_ids('f522') if f522_id not in self.f522_ids]
         self.debug = options['debug']
+        self.log_frame_sample = max(options.get('log_frame_sample', 1), 1)
+        self.command_routes = command_routes(self.mqtt_base_topic)
+        self.bulk_command_topic = f'{self.mqtt_base_topic}/{BULK_COMMAND_TOPIC}'
+        self.command_groups = command_groups(options.get('command_groups', []))
+        self.command_pool_size = options.get('command_pool_size', 0)
+        self.command_pool = None
+        state_snapshot = options.get('state_snapshot', {})
+        self.state_snapshot = None
+        if state_snapshot.get('file'):
+            self.state_snapshot = OWNStateSnapshot(self, state_snapshot['file'], state_snapshot.get('max_age', 900))
+        self.state_snapshot_restored = False
+        state_journal = options.get('state_journal', {})
+        self.state_journal = None
+        if state_journal.get('dir'):
+            self.state_journal = OWNStateJournal(self, state_journal['dir'], state_journal.get('segment_size_mb', 4),
+                                                 state_journal.get('retention_days', 30),
+                                                 state_journal.get('max_size_mb', 64),
+                                                 state_journal.get('exclude', ['who-18/#']))
+        state_cache = options.get('state_cache', {})
+        self.state_cache = OWNStateCache(self, state_cache.get('enabled', True), state_cache.get('state_max_age', 0),
+                                         state_cache.get('energy_max_age', 300), self.state_snapshot,
+                                         self.state_journal)
+        outbound = options.get('outbound', {})
+        self.scheduler = OWNFrameScheduler(self, outbound.get('frames_per_second', 10), outbound.get('queue_size', 100),
+                                           outbound.get('stats_interval', 60))
+        self.command_max_in_flight = outbound.get('max_in_flight', 4)
+        self.command_response_timeout = outbound.get('response_timeout', 10)
+        self.command_channel = OWNCommandChannel(self, self.command_max_in_flight, self.command_response_timeout)
+        energy_aggregation = options.get('energy_aggregation', {})
+        self.energy_aggregator = None
+        if energy_aggregation.get('enabled', False):
+            self.energy_aggregator = OWNEnergyAggregator(self, energy_aggregation.get('windows', [60, 900]),
+                                                         energy_aggregation.get('publish_interval', 60),
+                                                         energy_aggregation.get('raw', True),
+                                                         energy_aggregation.get('samples', 360))
+        state_query = options.get('state_query', {})
+        self.state_query = None
+        if state_query.get('enabled', True):
+            self.state_query = OWNStateQuery(self, state_query.get('ttl', 60), state_query.get('timeout', 5))
+        self.poller = OWNPoller(self.query_interval.get('jitter', 0.1))
+        self.create_poll_jobs()
+        capture = options.get('capture', {})
+        self.capture_file = capture.get('file', '')
+        self.capture_max_size = capture.get('max_size_mb', 0) * 1024 * 1024
+        self.frame_capture = None
+        self.frame_filter = OWNFrameFilter(options['frame_filter']) if options.get('frame_filter') else None
+        self.metrics.add_gauge_collector(self.metrics_gauges)
+        if self.frame_filter:
+            self.metrics.add_gauge_collector(self.frame_filter.metrics_gauges)
+        frame_tap = options.get('frame_tap', {})
+        self.frame_tap = OWNFrameTap(self, frame_tap.get('mode', 'sampled'), frame_tap.get('sample', 1),
+                                     frame_tap.get('batch_frames', 100), frame_tap.get('batch_interval_ms', 1000),
+                                     frame_tap.get('buffer_size', 1000))
+        profiler = options.get('profiler', {})
+        self.profiler = None
+        if profiler.get('enabled', True):
+            self.profiler = OWNProfiler(self, profiler.get('dir', '/addons/own2mqtt/log'), profiler.get('max_seconds', 300))
+        monitor_pipeline = options.get('monitor_pipeline', {})
+        self.monitor_pipeline = None
+        if monitor_pipeline.get('enabled', False):
+            self.monitor_pipeline = OWNMonitorPipeline(self, monitor_pipeline.get('frame_queue_size', 64),
+                                                       monitor_pipeline.get('publish_queue_size', 1024),
+                                                       monitor_pipeline.get('batch_size', 64),
+                                                       monitor_pipeline.get('overflow', 'drop'),
+                                                       monitor_pipeline.get('stats_interval', 60))
+            self.metrics.add_gauge_collector(self.monitor_pipeline.metrics_gauges)
 
         self.command_thread = self.monitor_thread = None
-        self.command_socket = self.monitor_socket = None
+        self.monitor_socket = None
+        self.monitor_reader = None
+        self.monitor_probe_pending = False
+        self.stopped = False
 
         self.mqtt_ready = self.monitor_ready = self.command_ready = False
+        # Threads wait on these instead of polling the flags above
+        self.mqtt_connected = threading.Event()
+        self.monitor_connected = threading.Event()
+
+    def mqtt_start(self):
+        self.logger.info('Connecting to MQTT Server %s:%s', self.mqtt_server_ip, self.mqtt_server_port)
+        self.mqtt_client = mqtt.Client(self.mqtt_client_name, True, {'base_topic': self.mqtt_base_topic, 'own_instance': self})
+        self.mqtt_client.username_pw_set(self.mqtt_server_user, self.mqtt_server_password)
+        self.mqtt_client.on_connect = self.on_mqtt_connect
+        self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
+        self.mqtt_client.on_message = self.on_mqtt_message
+        self.mqtt_client.connect(self.mqtt_server_ip, self.mqtt_server_port)
+        self.mqtt_client.loop_start()
 
     def run(self):
         try:
-            self.logger.info('Connecting to MQTT Server %s:%s', self.mqtt_server_ip, self.mqtt_server_port)
-            self.mqtt_client = mqtt.Client(self.mqtt_client_name, True, {'base_topic': self.mqtt_base_topic, 'own_instance': self})
-            self.mqtt_client.username_pw_set(self.mqtt_server_user, self.mqtt_server_password)
-            self.mqtt_client.on_connect = self.on_mqtt_connect
-            self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
-            self.mqtt_client.on_message = self.on_mqtt_message
-            self.mqtt_client.connect(self.mqtt_server_ip, self.mqtt_server_port)
-            self.mqtt_client.loop_start()
-
-            self.monitor_thread = threading.Thread(target=self.monitor_start)
+            if self.command_pool_size > 0:
+                self.command_pool = OWNCommandPool(self, self.command_pool_size)
+                self.command_pool.start()
+
+            self.metrics_start()
+            if self.state_snapshot:
+                self.state_snapshot.start()
+            if self.state_journal:
+                self.state_journal.start()
+            if self.energy_aggregator:
+                self.energy_aggregator.start()
+            if self.monitor_pipeline:
+                self.monitor_pipeline.start()
+            self.frame_tap.start()
+            self.scheduler.start()
+            self.mqtt_start()
+
+            self.monitor_thread = threading.Thread(target=self.monitor_start, daemon=True)
             self.monitor_thread.start()
 
-            while not (self.mqtt_ready and self.monitor_ready and self.command_ready):
-                self.command_start()
+            # Status answers are read from the monitor session, so wait for it before querying
+            self.mqtt_connected.wait()
+            self.monitor_connected.wait()
+            self.command_start()
 
-            # self.monitor_thread.join()
-            # self.command_thread.join()
+            # The main thread stays here, so SIGTERM and Ctrl-C end up in the cleanup below
+            self.monitor_thread.join()
 
         except (KeyboardInterrupt, SystemExit):
+            self.stop()
+
+    def stop(self):
+        # Files are closed and flushed once, a gzip capture left open is never terminated
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.frame_capture:
+            self.frame_capture.close()
+        if self.state_snapshot:
+            self.state_snapshot.flush()
+        if self.state_journal:
+            self.state_journal.flush()
+        if self.device_inventory:
+            self.device_inventory.save()
+        if self.mqtt_client:
             self.mqtt_client.loop_stop()
             self.mqtt_client.disconnect()
+        if self.monitor_socket:
             self.monitor_socket.close()
-            self.monitor_ready = False
-            self.command_socket.close()
+        self.monitor_ready = False
+        self.command_channel.close()
 
     def monitor_start(self):
-        logger = logging.getLogger("own2mqtt.monitor")
+        backoff = OWNBackoff(self.session_max_backoff)
         while True:
-            if self.mqtt_ready:
+            self.mqtt_connected.wait()
+            try:
+                self.logger.info('Starting MONITOR session with %s', self.own_server_address)
+
+                self.monitor_socket = self.connect_session(self.SET_MONITOR)
+
+                if self.monitor_socket:
+                    self.monitor_reader = OWNFrameReader(self.monitor_socket)
+                    frame_monitor = self.create_frame_monitor()
+                    self.logger.info('MONITOR started')
+                    self.monitor_ready = True
+                    self.monitor_connected.set()
+                    backoff.reset()
+
+                    self.monitor_loop(frame_monitor)
+                    self.logger.info('MONITOR Disconnected')
+            except Exception as e:
+                self.logger.info(e)
+                if self.debug:
+                    raise e
+            finally:
                 self.monitor_ready = False
-                try:
-                    self.logger.info('Starting MONITOR session with %s', self.own_server_address)
-
-                    self.monitor_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    self.monitor_socket.connect(self.own_server_address)
-                    data_received = self.monitor_socket.recv(4096)
-
-                    if data_received == self.ACK:
-                        self.monitor_socket.send(self.SET_MONITOR)
-
-                        data_received = self.monitor_socket.recv(4096)
-
-                        if data_received == self.AUTH_START:
-                            self.monitor_socket.send(self.ACK)
-
-                            if self.__authenticate(self.monitor_socket):
-                                last_frame = time.time()
-                                self.logger.info('MONITOR started')
-                                self.monitor_ready = True
-
-                                # Monitor each frame in socket
-                                while self.monitor_ready and (time.time() - last_frame) < 30:
-                                    frames = self.read_monitor_socket()
-                                    for frame in frames:
-                                        last_frame = time.time()
-                                        OWNFrameMonitor(frame, self)
-                                        self.mqtt_client.publish(f'{self.mqtt_base_topic}/last_frame', payload=frame, qos=0, retain=False)
-                                else:
-                                    self.monitor_ready = False
-                                    self.logger.info('MONITOR Disconnected')
-                except Exception as e:
-                    self.logger.info(e)
-                    if self.debug:
-                        if self.monitor_socket:
-                            self.monitor_socket.close()
-                            self.monitor_socket = None
-                        raise e
-                    time.sleep(5)
-
-    def command_connect(self):
-        self.logger.info('Starting COMMAND session with %s', self.own_server_address)
-
-        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.command_socket.connect(self.own_server_address)
-        data_received = self.command_socket.recv(4096)
-
-        if data_received == self.ACK:
-            self.command_socket.send(self.SET_COMMAND)
-
-            data_received = self.command_socket.recv(4096)
-
-            if data_received == self.AUTH_START:
-                self.command_socket.send(self.ACK)
-
-                if self.__authenticate(self.command_socket):
-                    self.logger.info('COMMAND started')
-                    self.command_ready = True
+                self.monitor_connected.clear()
+                if self.monitor_socket:
+                    self.monitor_socket.close()
+                    self.monitor_socket = None
+            time.sleep(backoff.next())
+
+    def monitor_loop(self, frame_monitor):
+        # The socket times out after keepalive_interval without frames. A quiet bus is fine: a KEEP_ALIVE goes out on
+        # the COMMAND session and its answer there proves the gateway alive, a dead MONITOR socket is left to TCP keepalive
+        self.monitor_probe_pending = False
+        while True:
+            try:
+                frames = self.read_monitor_socket()
+            except socket.timeout:
+                if not self.monitor_probe_pending:
+                    self.monitor_probe_pending = True
+                    current_socket = self.monitor_socket
+                    self.submit_status_query(self.KEEP_ALIVE,
+                                             lambda future: self.on_keepalive_response(current_socket, future))
+                continue
+            if self.monitor_pipeline:
+                self.monitor_pipeline.submit(frame_monitor, frames)
+                continue
+            for frame in frames:
+                self.handle_monitor_frame(frame_monitor, frame)
+
+    def on_keepalive_response(self, current_socket, future):
+        self.monitor_probe_pending = False
+        if future.cancelled() or future.exception() is None:
+            return
+        # No answer on the COMMAND session either, the blocked MONITOR read is woken up to reconnect
+        self.metrics.inc('own2mqtt_monitor_timeouts_total')
+        self.logger.info('KEEP_ALIVE failed: %s', future.exception())
+        try:
+            current_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def connect_session(self, session_frame):
+        session = 'monitor' if session_frame == self.SET_MONITOR else 'command'
+        self.metrics.inc('own2mqtt_session_connects_total', session=session)
+        current_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # No step of the handshake may block forever, a dead peer is also noticed by the kernel
+        current_socket.settimeout(self.session_connect_timeout)
+        self.enable_tcp_keepalive(current_socket, self.session_keepalive_interval)
+        try:
+            current_socket.connect(self.own_server_address)
+            data_received = current_socket.recv(4096)
 
-    def command_start(self):
-        self.command_connect()
+            if data_received == self.ACK:
+                current_socket.send(session_frame)
 
-        # Send command requests
-        self.write_socket(b'*#1*0##')
+                data_received = current_socket.recv(4096)
 
-        for thermo_zone in self.thermo_zones.keys():
-            self.write_socket(('*#4*%s##' % thermo_zone).encode())
-            self.write_socket(('*#4*%s*60##' % thermo_zone).encode())
+                if data_received == self.AUTH_START:
+                    current_socket.send(self.ACK)
+
+                    if self.__authenticate(current_socket):
+                        current_socket.settimeout(self.session_keepalive_interval)
+                        return current_socket
+        except OSError:
+            current_socket.close()
+            raise
+        current_socket.close()
+        return None
 
-        self.total_energy_query()
-        self.f522_start_power_request()
+    @staticmethod
+    def enable_tcp_keepalive(current_socket, interval):
+        current_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Linux only options, other systems keep their defaults
+        for option, value in (('TCP_KEEPIDLE', interval), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', 3)):
+            if hasattr(socket, option):
+                current_socket.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+    def create_frame_monitor(self):
+        if self.capture_file and not self.frame_capture:
+            self.frame_capture = OWNFrameCaptureWriter(self.capture_file, self.capture_max_size)
+        frame_monitor = OWNFrameMonitor(self)
+        if self.monitor_pipeline:
+            # Parsed values are handed to the publisher thread instead of the state cache
+            frame_monitor.publisher = self.monitor_pipeline
+        return frame_monitor
+
+    def handle_monitor_frame(self, frame_monitor, frame):
+        started = time.perf_counter()
+        if self.last_monitor_frame:
+            self.metrics.observe('own2mqtt_monitor_idle_seconds', started - self.last_monitor_frame)
+        self.last_monitor_frame = started
+        if self.frame_capture:
+            self.frame_capture.write(frame)
+        # Captures keep every frame so a replay can try other filter rules
+        if self.frame_filter and not self.frame_filter.allow(frame):
+            return
+        own_frame = frame_monitor.read_frame(frame)
+        self.metrics.observe('own2mqtt_frame_dispatch_seconds', time.perf_counter() - started)
+        if own_frame:
+            if self.device_inventory:
+                self.device_inventory.observe(own_frame)
+            self.metrics.inc('own2mqtt_frames_total', who=own_frame.who, frame_type=own_frame.frame_type)
+        else:
+            self.metrics.inc('own2mqtt_frames_total', who='unknown', frame_type='unknown')
+        self.frame_tap.record(frame)
+
+    def metrics_start(self):
+        if self.metrics_http_port:
+            self.metrics.start_http(self.metrics_http_port)
+        if self.metrics_mqtt_interval:
+            self.metrics.start_mqtt(self, self.metrics_mqtt_interval)
+
+    def metrics_gauges(self):
+        gauges = {
+            ('own2mqtt_mqtt_publishes', (('result', 'sent'),)): self.state_cache.published,
+            ('own2mqtt_mqtt_publishes', (('result', 'suppressed'),)): self.state_cache.suppressed,
+        }
+        for name, value in self.scheduler.stats().items():
+            gauges[('own2mqtt_scheduler', (('stat', name),))] = value
+        return gauges
 
-        frames = self.read_command_socket()
-        self.logger.info(frames)
-        if len(frames) > 0:
-            last_frame = time.time()
+    def command_start(self):
+        # Send command requests, the scheduler opens the COMMAND session on the first write
+        for encoded_frame in self.status_request_frames():
+            self.scheduler.submit_query(encoded_frame)
+
+        self.poller.start(self.scheduler.submit_query)
+        self.publish_poll_schedule()
+        if self.device_inventory:
+            self.device_inventory.start()
+
+    def execute_command(self, command):
+        # A pool session waits for each answer, bulk commands are pipelined on the command channel
+        if self.command_pool and not isinstance(command, OWNBulkCommand):
+            self.command_pool.submit(command)
         else:
-            self.logger.info('COMMAND Disconnected')
+            command.send()
 
     def write_socket(self, encoded_frame):
-        while True:
-            try:
-                self.command_socket.send(encoded_frame)
-                self.logger.debug('TX: %s' % encoded_frame.decode())
-                break
-            except (BrokenPipeError, IOError) as e:
-                self.command_socket.close()
-                self.command_socket = None
-                self.command_ready = False
-                self.command_connect()
-                self.write_socket(encoded_frame)
-
-    def f522_start_power_request(self):
-        for (f522_id) in self.f522_ids:
-            self.write_socket(f'*#18*7{f522_id}#0*#1200#1*1##'.encode())
+        # Returns a future resolved with the response frames, up to max_in_flight frames are pipelined
+        return self.command_channel.submit(encoded_frame)
+
+    def write_socket_batch(self, encoded_frames):
+        return self.command_channel.submit_batch(encoded_frames)
+
+    def submit_status_query(self, encoded_frame, callback=None):
+        self.scheduler.submit_query(encoded_frame, callback)
 
-    def total_energy_query(self):
+    def status_request_frames(self):
+        # Warm start: whatever the snapshot still knows is not queried again
+        frames = []
+        # Lights share one general request, sent unless every light the snapshot knows is fresh
+        if not self.snapshot_fresh('who-1/+/state'):
+            frames.append(b'*#1*0##')
+        for thermo_zone in self.thermo_zones.keys():
+            if not self.snapshot_fresh(f'who-4/zones/{thermo_zone}/temperature/current'):
+                frames.extend(self.thermo_zone_frames(thermo_zone))
+        return frames
+
+    def snapshot_fresh(self, topic_filter):
+        return self.state_snapshot is not None and self.state_snapshot.fresh(topic_filter)
+
+    def restore_state_snapshot(self):
+        if self.state_snapshot is None or self.state_snapshot_restored:
+            return
+        self.state_snapshot_restored = True
+        fresh_entries = self.state_snapshot.fresh_entries()
+        for topic, encoded_payload in fresh_entries:
+            self.state_cache.restore(topic, encoded_payload)
+        self.logger.info('Restored %s values from the state snapshot', len(fresh_entries))
+
+    @staticmethod
+    def thermo_zone_frames(thermo_zone):
+        return [f'*#4*{thermo_zone}##'.encode(), f'*#4*{thermo_zone}*60##'.encode()]
+
+    @staticmethod
+    def f522_power_request_frames(f522_id):
+        return [f'*#18*7{f522_id}#0*#1200#1*1##'.encode()]
+
+    @staticmethod
+    def total_energy_frames(f520_id):
+        return [f'*#18*5{f520_id}*51##'.encode(), f'*#18*5{f520_id}*53##'.encode(), f'*#18*5{f520_id}*54##'.encode()]
+
+    def create_poll_jobs(self):
         for (f520_id) in self.f520_ids:
-            self.write_socket(f'*#18*5{f520_id}*51##'.encode())
-            self.write_socket(f'*#18*5{f520_id}*53##'.encode())
-            self.write_socket(f'*#18*5{f520_id}*54##'.encode())
-        threading.Timer(self.query_interval['total_energy_query'], self.total_energy_query).start()
+            self.add_total_energy_job(f520_id)
+        for (f522_id) in self.f522_ids:
+            self.add_f522_power_job(f522_id)
+        for thermo_zone in self.thermo_zones.keys():
+            self.add_thermo_zone_job(thermo_zone)
+
+    def add_total_energy_job(self, f520_id):
+        self.poller.add_job(f'total_energy/{f520_id}', self.total_energy_frames(f520_id),
+                            self.poll_interval('total_energy', f520_id, 'total_energy_query', 60),
+                            run_now=not self.snapshot_fresh(f'who-18/5{f520_id}/total_energy'))
+
+    def add_f522_power_job(self, f522_id):
+        # The gateway streams F522 power for one minute, renew the request before it expires
+        self.poller.add_job(f'f522_power/{f522_id}', self.f522_power_request_frames(f522_id),
+                            self.poll_interval('f522_power', f522_id, 'f522_power_renewal', 50), run_now=True)
+
+    def add_thermo_zone_job(self, thermo_zone):
+        # Zones are already queried at startup, periodic refresh is opt-in
+        self.poller.add_job(f'thermo_zone/{thermo_zone}', self.thermo_zone_frames(thermo_zone),
+                            self.poll_interval('thermo_zone', thermo_zone, 'thermo_zone_query', 0))
+
+    def add_discovered_device(self, kind, device_id):
+        # Called by the device inventory for a device it did not know, polled like a configured one from now on.
+        # The lists are replaced, not changed, other threads may be iterating them
+        if kind == 'thermo_zone' and device_id not in self.thermo_zones:
+            self.thermo_zones = dict(self.thermo_zones, **{device_id: {}})
+            self.add_thermo_zone_job(device_id)
+            # Startup sync missed it, the rest of its values are queried once now
+            for encoded_frame in self.thermo_zone_frames(device_id):
+                self.submit_status_query(encoded_frame)
+        elif kind == 'f520' and device_id not in self.f520_ids:
+            self.f520_ids = self.f520_ids + [device_id]
+            self.add_total_energy_job(device_id)
+        elif kind == 'f522' and device_id not in self.f522_ids:
+            self.f522_ids = self.f522_ids + [device_id]
+            self.add_f522_power_job(device_id)
+        else:
+            return
+        if self.mqtt_ready:
+            self.publish_poll_schedule()
 
-    def read_command_socket(self):
-        return self.__read_socket(self.command_socket)
+    def poll_interval(self, job_type, device, query_interval_key, default):
+        return self.query_interval_overrides.get(f'{job_type}/{device}', self.query_interval.get(query_interval_key, default))
+
+    def publish_poll_schedule(self):
+        schedule = self.poller.schedule()
+        self.logger.info('Polling %s frames/hour with %s jobs', schedule['frames_per_hour'], len(schedule['jobs']))
+        self.mqtt_client.publish(f'{self.mqtt_base_topic}/poller/schedule', payload=json.dumps(schedule), qos=0, retain=True)
 
     def read_monitor_socket(self):
-        return self.__read_socket(self.monitor_socket)
+        return self.monitor_reader.read_frames()
 
     def __authenticate(self, current_socket):
         self.logger.info('Authenticating...')
+        started = time.perf_counter()
+        messages = self.authentication_messages(current_socket.recv(4096).decode())
+        if not messages:
+            return False
+        client_message, server_message = messages
+        current_socket.send(client_message)
+
+        if current_socket.recv(4096) == server_message:
+            current_socket.send(self.ACK)
+            self.metrics.observe('own2mqtt_authentication_seconds', time.perf_counter() - started)
+            self.logger.info('Authenticated')
+            return True
+        self.metrics.inc('own2mqtt_authentication_failures_total')
+        return False
+
+    def authentication_messages(self, data_received):
         rb_hex = self.__create_rb_hex()
         rb = self.__hex_to_decimal_string(rb_hex)
-        ra_search = regex.search(
-            r'\*#(\d{128})##', current_socket.recv(4096).decode())
+        ra_search = regex.search(r'\*#(\d{128})##', data_received)
         if not ra_search:
-            return False
+            return None
         ra_hex = self.__decimal_string_to_hex(ra_search.group(1))
         kab_hex = hashlib.sha256(self.own_password.encode()).hexdigest()
 
@@ -210,7 +531,6 @@ class OpenWebNet:
         client_digest_dec = self.__hex_to_decimal_string(client_digest)
 
         client_message = "*#%s*%s##" % (rb, client_digest_dec)
-        current_socket.send(client_message.encode())
 
         server_hash = hashlib.new('sha256')
         server_hash.update(ra_hex.encode())
@@ -220,46 +540,81 @@ class OpenWebNet:
         server_digest_dec = self.__hex_to_decimal_string(server_digest)
         server_message = "*#%s##" % server_digest_dec
 
-        if current_socket.recv(4096) == server_message.encode():
-            current_socket.send(self.ACK)
-            self.logger.info('Authenticated')
-            return True
-        return False
+        return client_message.encode(), server_message.encode()
 
     @staticmethod
     def on_mqtt_connect(client, userdata, flags, rc):
         logger = logging.getLogger("own2mqtt")
         logger.info('Connected to MQTT')
-        userdata['own_instance'].mqtt_ready = True
-
-        topics = [
-            (f'{userdata["base_topic"]}/command_frame', 0),
-            (f'{userdata["base_topic"]}/who-1/+/command', 0),
-            (f'{userdata["base_topic"]}/who-2/+/command', 0),
-            (f'{userdata["base_topic"]}/who-2/+/set_position', 0),
-            (f'{userdata["base_topic"]}/who-4/zones/+/mode/set', 0),
-            (f'{userdata["base_topic"]}/who-4/zones/+/temperature/set', 0),
-        ]
-        client.subscribe(topics)
+        own_instance = userdata['own_instance']
+        own_instance.metrics.inc('own2mqtt_mqtt_connects_total')
+        own_instance.state_cache.clear()
+        own_instance.restore_state_snapshot()
+        own_instance.mqtt_ready = True
+        own_instance.mqtt_connected.set()
+
+        # One callback per command topic, paho matches the topic so the command never parses it again
+        for route in own_instance.command_routes:
+            client.message_callback_add(route.topic_filter, functools.partial(own_instance.on_mqtt_command, route))
+        client.message_callback_add(own_instance.bulk_command_topic, own_instance.on_mqtt_bulk_command)
+        client.subscribe([(route.topic_filter, 0) for route in own_instance.command_routes] +
+                         [(own_instance.bulk_command_topic, 0)])
+        if own_instance.state_query:
+            for topic_filter in own_instance.state_query.topic_filters():
+                client.message_callback_add(topic_filter, own_instance.on_mqtt_state_get)
+            client.subscribe([(topic_filter, 0) for topic_filter in own_instance.state_query.topic_filters()])
+        dump_topic = f'{own_instance.mqtt_base_topic}/{FRAME_TAP_DUMP_TOPIC}'
+        client.message_callback_add(dump_topic, own_instance.on_mqtt_frame_dump)
+        client.subscribe(dump_topic)
+        if own_instance.state_journal:
+            history_topic = f'{own_instance.mqtt_base_topic}/{HISTORY_QUERY_TOPIC}'
+            client.message_callback_add(history_topic, own_instance.on_mqtt_history_query)
+            client.subscribe(history_topic)
+        if own_instance.profiler:
+            profiler_topic = f'{own_instance.mqtt_base_topic}/{PROFILER_COMMAND_TOPIC}'
+            client.message_callback_add(profiler_topic, own_instance.on_mqtt_profiler)
+            client.subscribe(profiler_topic)
 
     @staticmethod
     def on_mqtt_disconnect(client, userdata, rc):
         logger = logging.getLogger("own2mqtt")
         logger.info('MQTT Disconnected')
         userdata['own_instance'].mqtt_ready = False
+        userdata['own_instance'].mqtt_connected.clear()
 
     @staticmethod
     def on_mqtt_message(client, userdata, message):
         logger = logging.getLogger("own2mqtt")
         logger.debug('MQTT: TOPIC: %s | PAYLOAD: %s', message.topic, message.payload)
-        OWNFrameCommand(userdata['own_instance'], message.topic, message.payload)
-
-    @staticmethod
-    def __read_socket(current_socket):
-        data_received = ''
-        while not data_received.endswith('##'):
-            data_received = data_received + current_socket.recv(1).decode()
-        return regex.findall(r"\*#?[\d\*]*#?0?[\d\*]+#?[\d\*]*##", data_received)
+        own_instance = userdata['own_instance']
+        own_instance.scheduler.submit_command(OWNFrameCommand(own_instance, message.topic, message.payload))
+
+    def on_mqtt_command(self, route, client, userdata, message):
+        self.logger.debug('MQTT: TOPIC: %s | PAYLOAD: %s', message.topic, message.payload)
+        self.scheduler.submit_command(OWNFrameCommand(self, message.topic, message.payload, route))
+
+    def on_mqtt_bulk_command(self, client, userdata, message):
+        self.logger.debug('MQTT: TOPIC: %s | PAYLOAD: %s', message.topic, message.payload)
+        self.scheduler.submit_command(OWNBulkCommand(self, message.payload))
+
+    def on_mqtt_state_get(self, client, userdata, message):
+        # Answered from the state cache, the gateway is only asked for stale or missing values
+        self.logger.debug('MQTT: TOPIC: %s | PAYLOAD: %s', message.topic, message.payload)
+        self.state_query.handle(message.topic)
+
+    def on_mqtt_frame_dump(self, client, userdata, message):
+        self.logger.debug('MQTT: TOPIC: %s | PAYLOAD: %s', message.topic, message.payload)
+        self.frame_tap.dump(message.payload)
+
+    def on_mqtt_history_query(self, client, userdata, message):
+        self.logger.debug('MQTT: TOPIC: %s | PAYLOAD: %s', message.topic, message.payload)
+        # Off the paho network thread, a long time range reads many records
+        threading.Thread(target=self.state_journal.handle_query, args=(message.payload,), name='history-query',
+                         daemon=True).start()
+
+    def on_mqtt_profiler(self, client, userdata, message):
+        self.logger.info('Profiler command: %s', message.payload)
+        self.profiler.handle(message.payload)
 
     @staticmethod
     def __create_rb_hex():
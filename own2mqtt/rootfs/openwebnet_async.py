@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from openwebnet import OpenWebNet
+from own_backoff import OWNBackoff
+from own_bulk_command import OWNBulkCommand
+from own_command_channel import correlate_response
+from own_frame_command import OWNFrameCommand
+from own_frame_reader import OWNFrameReader
+
+
+class OpenWebNetAsync(OpenWebNet):
+    # Same MQTT topic contract as OpenWebNet, but monitor, command and periodic queries share one event loop
+    def __init__(self, options):
+        super().__init__(options)
+
+        self.loop = None
+        self.mqtt_ready_event = None
+        self.mqtt_message_queue = None
+        self.command_lock = None
+        self.command_slots = None
+        self.command_queued = None
+        self.command_in_flight = deque()
+        self.command_read_task = None
+        self.keepalive_task = None
+        self.command_backoff = OWNBackoff(self.session_max_backoff)
+        self.command_stream_reader = self.command_stream_writer = None
+
+    def run(self):
+        try:
+            asyncio.run(self.run_async())
+        except (KeyboardInterrupt, SystemExit):
+            self.stop()
+
+    async def run_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.mqtt_ready_event = asyncio.Event()
+        self.mqtt_message_queue = asyncio.Queue()
+        self.command_lock = asyncio.Lock()
+        self.command_slots = asyncio.Semaphore(self.command_max_in_flight)
+        # Wakes the command reader up to arm the timeout of a request written while it was idle
+        self.command_queued = asyncio.Event()
+
+        # paho keeps its own network thread, its callbacks are bridged into the loop below
+        self.metrics_start()
+        if self.state_snapshot:
+            self.state_snapshot.start()
+        if self.state_journal:
+            self.state_journal.start()
+        if self.energy_aggregator:
+            self.energy_aggregator.start()
+        if self.monitor_pipeline:
+            self.monitor_pipeline.start()
+        self.frame_tap.start()
+        self.mqtt_start()
+
+        await asyncio.gather(self.monitor_session(), self.command_session(), self.poll_loop())
+
+    async def open_session(self, session_frame):
+        # No step of the handshake may wait forever
+        return await asyncio.wait_for(self.open_session_handshake(session_frame), self.session_connect_timeout)
+
+    async def open_session_handshake(self, session_frame):
+        session = 'monitor' if session_frame == self.SET_MONITOR else 'command'
+        self.metrics.inc('own2mqtt_session_connects_total', session=session)
+        stream_reader, stream_writer = await asyncio.open_connection(*self.own_server_address)
+        self.enable_tcp_keepalive(stream_writer.get_extra_info('socket'), self.session_keepalive_interval)
+        if await stream_reader.read(4096) == self.ACK:
+            await self.write_stream(stream_writer, session_frame)
+
+            if await stream_reader.read(4096) == self.AUTH_START:
+                await self.write_stream(stream_writer, self.ACK)
+
+                if await self.authenticate(stream_reader, stream_writer):
+                    return stream_reader, stream_writer
+        stream_writer.close()
+        return None
+
+    async def authenticate(self, stream_reader, stream_writer):
+        self.logger.info('Authenticating...')
+        started = time.perf_counter()
+        messages = self.authentication_messages((await stream_reader.read(4096)).decode())
+        if not messages:
+            return False
+        client_message, server_message = messages
+        await self.write_stream(stream_writer, client_message)
+
+        if await stream_reader.read(4096) == server_message:
+            await self.write_stream(stream_writer, self.ACK)
+            self.metrics.observe('own2mqtt_authentication_seconds', time.perf_counter() - started)
+            self.logger.info('Authenticated')
+            return True
+        self.metrics.inc('own2mqtt_authentication_failures_total')
+        return False
+
+    async def monitor_session(self):
+        backoff = OWNBackoff(self.session_max_backoff)
+        while True:
+            await self.mqtt_ready_event.wait()
+            stream_writer = None
+            try:
+                self.logger.info('Starting MONITOR session with %s', self.own_server_address)
+                session = await self.open_session(self.SET_MONITOR)
+                if session:
+                    stream_reader, stream_writer = session
+                    frame_monitor = self.create_frame_monitor()
+                    self.logger.info('MONITOR started')
+                    self.monitor_ready = True
+                    backoff.reset()
+
+                    await self.monitor_loop(stream_reader, frame_monitor)
+                    self.logger.info('MONITOR Disconnected')
+            except Exception as e:
+                self.logger.info(e)
+                if self.debug:
+                    raise e
+            finally:
+                self.monitor_ready = False
+                if stream_writer:
+                    stream_writer.close()
+            await asyncio.sleep(backoff.next())
+
+    async def monitor_loop(self, stream_reader, frame_monitor):
+        # No frame for keepalive_interval is fine on a quiet bus: a KEEP_ALIVE goes out on the COMMAND session and
+        # its answer there proves the gateway alive, a dead MONITOR socket is left to TCP keepalive
+        frame_reader = OWNFrameReader()
+        self.keepalive_task = None
+        while True:
+            frames = frame_reader.pop_frames()
+            if frames:
+                if self.monitor_pipeline:
+                    # With overflow block a full frame queue also holds up the event loop
+                    self.monitor_pipeline.submit(frame_monitor, frames)
+                    continue
+                for frame in frames:
+                    self.handle_monitor_frame(frame_monitor, frame)
+                continue
+            try:
+                frame_reader.feed(await asyncio.wait_for(stream_reader.read(4096), self.session_keepalive_interval))
+            except asyncio.TimeoutError:
+                if self.keepalive_task and self.keepalive_task.done() and not self.keepalive_task.result():
+                    # No answer on the COMMAND session either
+                    self.metrics.inc('own2mqtt_monitor_timeouts_total')
+                    return
+                if self.keepalive_task is None or self.keepalive_task.done():
+                    self.keepalive_task = asyncio.create_task(self.keepalive_probe())
+
+    async def keepalive_probe(self):
+        # True once the gateway answers the KEEP_ALIVE on the COMMAND session
+        try:
+            await (await self.write_command(self.KEEP_ALIVE))
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            self.logger.info('KEEP_ALIVE failed: %s', e)
+            return False
+
+    async def command_connect_async(self):
+        self.logger.info('Starting COMMAND session with %s', self.own_server_address)
+        session = await self.open_session(self.SET_COMMAND)
+        if not session:
+            return False
+        self.command_stream_reader, self.command_stream_writer = session
+        self.command_backoff.reset()
+        self.command_read_task = asyncio.create_task(self.command_read_loop(self.command_stream_reader))
+        self.logger.info('COMMAND started')
+        self.command_ready = True
+        return True
+
+    def command_close_async(self):
+        if self.command_stream_writer:
+            self.command_stream_writer.close()
+        self.command_stream_reader = self.command_stream_writer = None
+        self.command_ready = False
+        failed = [future for future, _, _ in self.command_in_flight]
+        self.command_in_flight.clear()
+        for future in failed:
+            if not future.done():
+                future.set_exception(ConnectionError('COMMAND session closed'))
+
+    async def command_session(self):
+        await self.mqtt_ready_event.wait()
+
+        # Send command requests, pipelined up to max_in_flight
+        for encoded_frame in self.status_request_frames():
+            await self.write_command(encoded_frame)
+        self.publish_poll_schedule()
+        if self.device_inventory:
+            self.device_inventory.start()
+
+        while True:
+            topic, payload, route = await self.mqtt_message_queue.get()
+            try:
+                if topic == self.bulk_command_topic:
+                    command = OWNBulkCommand(self, payload)
+                    if command.frames:
+                        command.mark_sent()
+                        command.track(await self.write_commands(command.encoded_frames()))
+                    continue
+                command = OWNFrameCommand(self, topic, payload, route)
+                if command.frame is None:
+                    continue
+                command.mark_sent()
+                (await self.write_command(command.frame)).add_done_callback(command.on_response)
+            except Exception as e:
+                self.logger.info(e)
+                self.command_close_async()
+                if self.debug:
+                    raise e
+
+    async def write_command(self, encoded_frame):
+        # Returns a future resolved with the response frames, waits while max_in_flight frames are unanswered
+        return (await self.write_commands([encoded_frame]))[0]
+
+    async def write_commands(self, encoded_frames):
+        # Up to max_in_flight frames go out in a single write, each one still gets its own future
+        futures = []
+        for start in range(0, len(encoded_frames), self.command_max_in_flight):
+            chunk = encoded_frames[start:start + self.command_max_in_flight]
+            for _ in chunk:
+                await self.command_slots.acquire()
+            futures.extend(await self.write_command_chunk(chunk))
+        return futures
+
+    async def write_command_chunk(self, encoded_frames):
+        while True:
+            futures = []
+            try:
+                async with self.command_lock:
+                    if self.command_stream_writer or await self.command_connect_async():
+                        # Written and queued in the same step, so in_flight keeps the wire order
+                        self.command_stream_writer.write(b''.join(encoded_frames))
+                        sent = time.monotonic()
+                        for _ in encoded_frames:
+                            future = self.loop.create_future()
+                            future.add_done_callback(lambda _: self.command_slots.release())
+                            future.add_done_callback(self.on_command_done)
+                            self.command_in_flight.append((future, [], sent))
+                            futures.append(future)
+                        self.command_queued.set()
+                        if self.logger.isEnabledFor(logging.DEBUG):
+                            self.logger.debug('TX: %s', b''.join(encoded_frames).decode())
+                        await self.command_stream_writer.drain()
+                        return futures
+            except (OSError, asyncio.TimeoutError) as e:
+                self.logger.info(e)
+                self.command_close_async()
+                # Frames already queued have failed with the session and released their slots
+                if futures:
+                    return futures
+            await asyncio.sleep(self.command_backoff.next())
+
+    def on_command_done(self, future):
+        # Retrieves the failure of every request, most futures (status requests, polls) are never awaited
+        if not future.cancelled() and future.exception():
+            self.logger.debug('COMMAND request failed: %s', future.exception())
+
+    async def command_read_loop(self, stream_reader):
+        command_reader = OWNFrameReader()
+        read_task = None
+        try:
+            while True:
+                # An idle session is fine, a request without answer is not: the oldest request in flight must be
+                # answered within the timeout from its own send time
+                self.command_queued.clear()
+                timeout = None
+                if self.command_in_flight:
+                    timeout = self.command_in_flight[0][2] + self.command_response_timeout - time.monotonic()
+                    if timeout <= 0:
+                        raise asyncio.TimeoutError()
+                if read_task is None:
+                    read_task = asyncio.ensure_future(stream_reader.read(4096))
+                queued_task = asyncio.ensure_future(self.command_queued.wait())
+                await asyncio.wait((read_task, queued_task), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                queued_task.cancel()
+                if not read_task.done():
+                    continue
+                data = read_task.result()
+                read_task = None
+                command_reader.feed(data)
+                for frame in command_reader.pop_frames():
+                    response = correlate_response(self.command_in_flight, frame)
+                    if response and not response[0].done():
+                        response[0].set_result(response[1])
+        except asyncio.TimeoutError:
+            if stream_reader is self.command_stream_reader:
+                self.logger.info('COMMAND session: no answer in %s s', self.command_response_timeout)
+                self.command_close_async()
+        except OSError as e:
+            if stream_reader is self.command_stream_reader:
+                self.logger.info('COMMAND session: %s', e)
+                self.command_close_async()
+        finally:
+            if read_task:
+                read_task.cancel()
+
+    async def poll_loop(self):
+        await self.mqtt_ready_event.wait()
+        while True:
+            delay = self.poller.next_delay()
+            await asyncio.sleep(60 if delay is None else delay)
+            for encoded_frame in self.poller.pop_due():
+                await self.write_command(encoded_frame)
+
+    @staticmethod
+    async def write_stream(stream_writer, data):
+        stream_writer.write(data)
+        await stream_writer.drain()
+
+    @staticmethod
+    def on_mqtt_connect(client, userdata, flags, rc):
+        OpenWebNet.on_mqtt_connect(client, userdata, flags, rc)
+        own_instance = userdata['own_instance']
+        own_instance.loop.call_soon_threadsafe(own_instance.mqtt_ready_event.set)
+
+    @staticmethod
+    def on_mqtt_disconnect(client, userdata, rc):
+        OpenWebNet.on_mqtt_disconnect(client, userdata, rc)
+        own_instance = userdata['own_instance']
+        own_instance.loop.call_soon_threadsafe(own_instance.mqtt_ready_event.clear)
+
+    @staticmethod
+    def on_mqtt_message(client, userdata, message):
+        # Runs on the paho network thread, the command itself is written from the event loop
+        own_instance = userdata['own_instance']
+        own_instance.logger.debug('MQTT: TOPIC: %s | PAYLOAD: %s', message.topic, message.payload)
+        own_instance.loop.call_soon_threadsafe(own_instance.mqtt_message_queue.put_nowait,
+                                               (message.topic, message.payload, None))
+
+    def on_mqtt_command(self, route, client, userdata, message):
+        self.logger.debug('MQTT: TOPIC: %s | PAYLOAD: %s', message.topic, message.payload)
+        self.loop.call_soon_threadsafe(self.mqtt_message_queue.put_nowait, (message.topic, message.payload, route))
+
+    def on_mqtt_bulk_command(self, client, userdata, message):
+        self.on_mqtt_command(None, client, userdata, message)
+
+    def submit_status_query(self, encoded_frame, callback=None):
+        # Called from the paho network thread and the device inventory
+        self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self.status_query(encoded_frame, callback)))
+
+    async def status_query(self, encoded_frame, callback):
+        future = await self.write_command(encoded_frame)
+        if callback:
+            future.add_done_callback(callback)
@@ -0,0 +1,17 @@
+import random
+
+
+class OWNBackoff:
+    def __init__(self, maximum=60, initial=1):
+        self.maximum = maximum
+        self.initial = initial
+        self.delay = initial
+
+    def next(self):
+        # Doubles up to maximum, the jitter keeps several sessions from reconnecting in lockstep
+        delay = self.delay * random.uniform(0.8, 1.2)
+        self.delay = min(self.delay * 2, self.maximum)
+        return delay
+
+    def reset(self):
+        self.delay = self.initial
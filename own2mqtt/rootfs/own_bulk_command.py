@@ -0,0 +1,155 @@
+import functools
+import json
+import logging
+import threading
+import time
+
+from own_frame_command import LIGHT_COMMANDS, SHUTTER_COMMANDS
+
+
+# Relative to mqtt_base_topic
+BULK_COMMAND_TOPIC = 'bulk/command'
+BULK_RESULT_TOPIC = 'bulk/result'
+
+# WHO -> MQTT action -> WHAT, for the actuators a bulk command can switch
+BULK_ACTIONS = {'1': LIGHT_COMMANDS, '2': SHUTTER_COMMANDS}
+
+
+def command_groups(group_options):
+    # "who-1/#1=11,12,13" -> {'1': [('#1', frozenset({'11', '12', '13'}))]}, largest groups first.
+    # Areas and the general address are listed the same way, e.g. "who-1/2=21,22,23" or "who-2/0=..."
+    groups = {}
+    for group_option in group_options:
+        address, _, members = group_option.partition('=')
+        who, _, where = address.partition('/')
+        groups.setdefault(who[len('who-'):], []).append((where, frozenset(members.split(','))))
+    for who_groups in groups.values():
+        who_groups.sort(key=lambda group: len(group[1]), reverse=True)
+    return groups
+
+
+class OWNBulkFrame:
+    __slots__ = ('frame', 'who', 'action', 'members')
+
+    def __init__(self, who, action, where, members):
+        self.frame = f'*{who}*{BULK_ACTIONS[who][action]}*{where}##'.encode()
+        self.who = who
+        self.action = action
+        # The WHEREs switched by this frame, a group address stands for all its members
+        self.members = members
+
+
+class OWNBulkCommand:
+    def __init__(self, own_instance, payload):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        # Never coalesced by the scheduler
+        self.who = None
+        self.where = None
+        self.request_id = None
+        self.commands = 0
+        self.invalid = 0
+        self.frames = []
+        self.frame = None
+        self.sent_at = None
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.results = {'ack': 0, 'nack': 0, 'failed': 0}
+
+        self.build_frames(self.parse(payload))
+        if self.frames:
+            self.frame = b''.join(bulk_frame.frame for bulk_frame in self.frames)
+        else:
+            self.publish_result()
+
+    def parse(self, payload):
+        # [{"who": 1, "where": "12", "action": "ON"}, [2, "41", "CLOSE"], ...]
+        # or {"id": "scene-1", "commands": [...]} to get the id back in the result
+        try:
+            request = json.loads(payload)
+        except ValueError as e:
+            self.logger.info('Bulk command: %s', e)
+            return {}
+        if isinstance(request, dict):
+            self.request_id = request.get('id')
+            request = request.get('commands', [])
+        if not isinstance(request, list):
+            self.logger.info('Bulk command: expected a list of commands')
+            return {}
+        # The last action for a WHERE wins, as for single commands queued for the same WHERE
+        actions = {}
+        for item in request:
+            self.commands += 1
+            if isinstance(item, dict):
+                item = (item.get('who'), item.get('where'), item.get('action'))
+            if not isinstance(item, (list, tuple)) or len(item) != 3:
+                self.invalid += 1
+                continue
+            who, where, action = str(item[0]), str(item[1]), str(item[2]).encode()
+            if action not in BULK_ACTIONS.get(who, {}):
+                self.invalid += 1
+                continue
+            actions[(who, where)] = action
+        if self.invalid:
+            self.logger.info('Bulk command: %s of %s commands ignored', self.invalid, self.commands)
+        return actions
+
+    def build_frames(self, actions):
+        targets = {}
+        for (who, where), action in actions.items():
+            targets.setdefault((who, action), set()).add(where)
+        for (who, action), wheres in targets.items():
+            # A group, area or general frame replaces its members only if all of them get the same action
+            for group_where, members in self.own_instance.command_groups.get(who, ()):
+                if members <= wheres:
+                    wheres -= members
+                    self.frames.append(OWNBulkFrame(who, action, group_where, members))
+            for where in sorted(wheres):
+                self.frames.append(OWNBulkFrame(who, action, where, (where,)))
+
+    def encoded_frames(self):
+        return [bulk_frame.frame for bulk_frame in self.frames]
+
+    def send(self):
+        if not self.frames:
+            return
+        self.mark_sent()
+        self.track(self.own_instance.write_socket_batch(self.encoded_frames()))
+
+    def mark_sent(self):
+        self.sent_at = time.perf_counter()
+
+    def track(self, futures):
+        self.pending = len(futures)
+        for bulk_frame, future in zip(self.frames, futures):
+            future.add_done_callback(functools.partial(self.on_response, bulk_frame))
+
+    def on_response(self, bulk_frame, future):
+        if future.cancelled() or future.exception():
+            result = 'failed'
+        elif self.own_instance.ACK.decode() in future.result():
+            result = 'ack'
+        elif self.own_instance.NACK.decode() in future.result():
+            result = 'nack'
+        else:
+            result = 'failed'
+        if result == 'ack' and bulk_frame.who == '1':
+            for where in bulk_frame.members:
+                self.own_instance.state_cache.publish(f'{self.own_instance.mqtt_base_topic}/who-1/{where}/state',
+                                                      payload=bulk_frame.action, qos=1, retain=True)
+        with self.lock:
+            self.results[result] += 1
+            self.pending -= 1
+            if self.pending:
+                return
+        self.own_instance.metrics.observe('own2mqtt_bulk_command_seconds', time.perf_counter() - self.sent_at)
+        self.publish_result()
+
+    def publish_result(self):
+        result = dict(self.results, id=self.request_id, commands=self.commands, invalid=self.invalid,
+                      frames=len(self.frames))
+        if self.sent_at:
+            result['seconds'] = round(time.perf_counter() - self.sent_at, 3)
+        self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/{BULK_RESULT_TOPIC}',
+                                              payload=json.dumps(result), qos=0, retain=False)
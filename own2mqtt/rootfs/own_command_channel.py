@@ -0,0 +1,148 @@
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from own_backoff import OWNBackoff
+from own_frame_reader import OWNFrameReader
+
+
+# ACK and NACK close the answer to a request, anything read before them belongs to the same request
+RESPONSE_END = ('*#*1##', '*#*0##')
+
+
+def correlate_response(in_flight, frame):
+    # The gateway answers in request order, so every frame belongs to the oldest request still in flight.
+    # Entries are (future, response frames, monotonic send time), returns (future, response frames) once that
+    # request is complete.
+    if not in_flight:
+        return None
+    future, response_frames, _ = in_flight[0]
+    response_frames.append(frame)
+    if frame in RESPONSE_END:
+        in_flight.popleft()
+        return future, response_frames
+    return None
+
+
+class OWNCommandChannel:
+    def __init__(self, own_instance, max_in_flight=4, timeout=10):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        # Guards the socket and in_flight, so frames are queued in the order they are written
+        self.lock = threading.Lock()
+        self.socket = None
+        self.in_flight = deque()
+        self.backoff = OWNBackoff(own_instance.session_max_backoff)
+
+    def submit(self, encoded_frame):
+        # Blocks while max_in_flight frames wait for their answer, the future resolves with the response frames
+        return self.submit_batch([encoded_frame])[0]
+
+    def submit_batch(self, encoded_frames):
+        # Up to max_in_flight frames go out in a single write, each one still gets its own future
+        futures = []
+        for start in range(0, len(encoded_frames), self.max_in_flight):
+            chunk = encoded_frames[start:start + self.max_in_flight]
+            for _ in chunk:
+                self.slots.acquire()
+            futures.extend(self.__write(chunk))
+        return futures
+
+    def __write(self, encoded_frames):
+        while True:
+            failed = []
+            with self.lock:
+                try:
+                    if self.socket or self.__connect():
+                        self.socket.sendall(b''.join(encoded_frames))
+                        futures = []
+                        sent = time.monotonic()
+                        for _ in encoded_frames:
+                            future = Future()
+                            future.add_done_callback(self.__release)
+                            self.in_flight.append((future, [], sent))
+                            futures.append(future)
+                        if self.logger.isEnabledFor(logging.DEBUG):
+                            self.logger.debug('TX: %s', b''.join(encoded_frames).decode())
+                        return futures
+                except OSError as e:
+                    self.logger.info(e)
+                    failed = self.__close(self.socket)
+            self.__fail(failed)
+            time.sleep(self.backoff.next())
+
+    def close(self):
+        with self.lock:
+            failed = self.__close(self.socket)
+        self.__fail(failed)
+
+    def __connect(self):
+        self.logger.info('Starting COMMAND session with %s', self.own_instance.own_server_address)
+        current_socket = self.own_instance.connect_session(self.own_instance.SET_COMMAND)
+        if not current_socket:
+            return False
+        current_socket.settimeout(self.timeout)
+        self.backoff.reset()
+        self.socket = current_socket
+        threading.Thread(target=self.__read_loop, args=(current_socket,), name='command-reader', daemon=True).start()
+        self.logger.info('COMMAND started')
+        self.own_instance.command_ready = True
+        return True
+
+    def __read_loop(self, current_socket):
+        reader = OWNFrameReader(current_socket)
+        while True:
+            try:
+                frames = reader.read_frames()
+            except socket.timeout:
+                # An idle session is fine, a request without answer is not. The socket timeout runs from the last
+                # read, every request gets the full timeout from its own send time
+                with self.lock:
+                    sent = self.in_flight[0][2] if self.in_flight else None
+                remaining = self.timeout if sent is None else sent + self.timeout - time.monotonic()
+                if remaining > 0:
+                    current_socket.settimeout(remaining)
+                    continue
+                self.logger.info('COMMAND session: no answer in %s s', self.timeout)
+                break
+            except OSError as e:
+                self.logger.info('COMMAND session: %s', e)
+                break
+            completed = []
+            with self.lock:
+                for frame in frames:
+                    response = correlate_response(self.in_flight, frame)
+                    if response:
+                        completed.append(response)
+            for future, response_frames in completed:
+                future.set_result(response_frames)
+        with self.lock:
+            failed = self.__close(current_socket)
+        self.__fail(failed)
+
+    def __close(self, current_socket):
+        # Only the current socket is closed, a late reader of an older session leaves the new one alone
+        if current_socket is None or current_socket is not self.socket:
+            return []
+        current_socket.close()
+        self.socket = None
+        self.own_instance.command_ready = False
+        failed = [future for future, _, _ in self.in_flight]
+        self.in_flight.clear()
+        return failed
+
+    def __release(self, future):
+        self.slots.release()
+
+    @staticmethod
+    def __fail(futures):
+        # Outside the lock, done callbacks may submit again
+        for future in futures:
+            future.set_exception(ConnectionError('COMMAND session closed'))
@@ -0,0 +1,92 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from own_backoff import OWNBackoff
+from own_command_channel import correlate_response
+from own_frame_reader import OWNFrameReader
+
+
+class OWNCommandSession:
+    def __init__(self, current_socket, timeout):
+        self.socket = current_socket
+        self.socket.settimeout(timeout)
+        self.reader = OWNFrameReader(current_socket)
+
+    def send(self, command):
+        self.socket.sendall(command.frame)
+        command.mark_sent()
+        command.handle_response(self.read_response())
+
+    def read_response(self):
+        # Frames up to the ACK or NACK, a multi-frame status answer must not be left for the next command
+        in_flight = deque([(None, [], None)])
+        while True:
+            for frame in self.reader.read_frames():
+                response = correlate_response(in_flight, frame)
+                if response:
+                    return response[1]
+
+    def close(self):
+        self.socket.close()
+
+
+class OWNCommandPool:
+    def __init__(self, own_instance, size, timeout=10):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        self.size = size
+        self.timeout = timeout
+        self.commands = queue.Queue()
+        self.workers = []
+
+    def start(self):
+        for index in range(self.size):
+            worker = threading.Thread(target=self.__worker, args=(index,), name=f'command-{index}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, command):
+        if command.frame is not None:
+            self.commands.put((command, 0))
+
+    def __connect(self, index):
+        # Keep retrying in the worker thread, the other sessions keep serving commands meanwhile
+        backoff = OWNBackoff(self.own_instance.session_max_backoff)
+        while True:
+            try:
+                self.logger.info('Starting COMMAND session %s with %s', index, self.own_instance.own_server_address)
+                current_socket = self.own_instance.connect_session(self.own_instance.SET_COMMAND)
+                if current_socket:
+                    self.logger.info('COMMAND session %s started', index)
+                    return OWNCommandSession(current_socket, self.timeout)
+            except OSError as e:
+                self.logger.info(e)
+            time.sleep(backoff.next())
+
+    def __worker(self, index):
+        session = None
+        while True:
+            if session is None:
+                session = self.__connect(index)
+            command, attempt = self.commands.get()
+            try:
+                session.send(command)
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug('TX: %s', command.frame.decode())
+            except OSError as e:
+                # Drop the session so a late response is never read as the answer to another command
+                self.logger.info('COMMAND session %s: %s', index, e)
+                session.close()
+                session = None
+                if attempt == 0:
+                    self.commands.put((command, attempt + 1))
+            except Exception as e:
+                # A bad command or response must not end the worker, the session is reopened in case a response
+                # was left half read, the command is not retried
+                self.logger.info('COMMAND session %s: %s', index, e)
+                session.close()
+                session = None
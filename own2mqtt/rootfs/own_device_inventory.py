@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from own_frame_monitor import OWNFrameMonitor
+
+
+KINDS = ('light', 'shutter', 'thermo_zone', 'f520', 'f522')
+
+
+def inventory_entry(own_frame):
+    # (kind, id) of the device a frame comes from, None for areas, groups, general addresses and other WHOs
+    who = own_frame.who
+    where = own_frame.where
+    if not where:
+        return None
+    if who in ('1', '2'):
+        # Points only: areas have one digit (00 and 10 are areas too), groups and general never match
+        if where.isdigit() and len(where) >= 2 and where not in ('00', '10'):
+            return 'light' if who == '1' else 'shutter', where
+        return None
+    if who == '4':
+        # Zone, zone#actuator, the central unit is #0 and external probes are 5xx
+        zone = where.split('#')[0]
+        if zone.isdigit() and 0 < int(zone) < 100:
+            return 'thermo_zone', zone
+        return None
+    if who == '18':
+        meter = where.split('#')[0]
+        if len(meter) > 1 and meter[1:].isdigit():
+            if meter[0] == '5':
+                return 'f520', meter[1:]
+            if meter[0] == '7':
+                return 'f522', meter[1:]
+    return None
+
+
+class OWNDeviceInventory:
+    # Devices answering status requests or seen on the monitor, with the last time each one was seen
+    def __init__(self, own_instance, path='/data/device_inventory.json', frames_per_second=5, rescan_hours=24,
+                 full_scan_days=7, forget_days=30, max_thermo_zone=99, max_f520_id=16, max_f522_id=16,
+                 answer_timeout=10):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        self.path = path
+        self.frames_per_second = max(frames_per_second, 1)
+        self.rescan_interval = rescan_hours * 3600
+        self.full_scan_interval = full_scan_days * 86400
+        self.forget_after = forget_days * 86400
+        self.max_ids = {'thermo_zone': max_thermo_zone, 'f520': max_f520_id, 'f522': max_f522_id}
+        self.answer_timeout = answer_timeout
+        # Created on start, the state cache does not exist yet while the options are read
+        self.frame_monitor = None
+
+        self.lock = threading.Lock()
+        # Kind -> {id: epoch last seen}
+        self.devices = {kind: {} for kind in KINDS}
+        self.full_scan = 0
+        self.scan = 0
+        self.thread = None
+        # (WHO, WHERE) of the monitor frames already looked at since the last sweep started
+        self.seen = set()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as inventory_file:
+                inventory = json.load(inventory_file)
+            self.full_scan = inventory.get('full_scan', 0)
+            self.scan = inventory.get('scan', 0)
+            for kind in KINDS:
+                self.devices[kind] = {str(device_id): seen for device_id, seen in inventory['devices'].get(kind, {}).items()}
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            self.logger.info('Device inventory %s: %s', self.path, e)
+            return
+        self.logger.info('Device inventory %s: %s', self.path,
+                         ', '.join(f'{len(self.devices[kind])} {kind}' for kind in KINDS))
+
+    def save(self):
+        with self.lock:
+            inventory = {'full_scan': self.full_scan, 'scan': self.scan,
+                         'devices': {kind: dict(devices) for kind, devices in self.devices.items()}}
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(f'{self.path}.tmp', 'w', encoding='utf-8') as inventory_file:
+                json.dump(inventory, inventory_file)
+            os.replace(f'{self.path}.tmp', self.path)
+        except OSError as e:
+            self.logger.info('Device inventory %s: %s', self.path, e)
+
+    def device_ids(self, kind):
+        with self.lock:
+            return sorted(self.devices[kind], key=lambda device_id: (len(device_id), device_id))
+
+    def observe(self, own_frame):
+        # Called for every monitor frame, a known address costs a set lookup
+        key = (own_frame.who, own_frame.where)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        entry = inventory_entry(own_frame)
+        if entry:
+            self.__found(*entry)
+
+    def start(self):
+        if self.thread:
+            return
+        # Sweep answers read on the command session update the state cache like monitor frames
+        self.frame_monitor = OWNFrameMonitor(self.own_instance)
+        self.thread = threading.Thread(target=self.__sweep_loop, name='device-inventory', daemon=True)
+        self.thread.start()
+
+    def sweep_frames(self, full):
+        # General and area requests make every light and shutter point answer, zones and meters are asked one by one:
+        # every possible address on a full sweep, only the known ones otherwise
+        frames = [b'*#1*0##', b'*#2*0##']
+        if full:
+            frames += [f'*#{who}*{area}##'.encode() for who in ('1', '2') for area in range(1, 10)]
+            ids = {kind: [str(device_id) for device_id in range(1, max_id + 1)] for kind, max_id in self.max_ids.items()}
+        else:
+            ids = {kind: self.device_ids(kind) for kind in self.max_ids}
+        frames += [f'*#4*{thermo_zone}*0##'.encode() for thermo_zone in ids['thermo_zone']]
+        frames += [f'*#18*5{f520_id}*51##'.encode() for f520_id in ids['f520']]
+        frames += [f'*#18*7{f522_id}#0*51##'.encode() for f522_id in ids['f522']]
+        return frames
+
+    def sweep(self, full):
+        started = time.time()
+        self.seen = set()
+        frames = self.sweep_frames(full)
+        self.logger.info('Device inventory: %s sweep, %s status requests', 'full' if full else 'incremental', len(frames))
+        # [status requests still unanswered]
+        request = [len(frames)]
+        answered = threading.Event()
+        # The command channel pipelines the requests, the pace keeps the gateway and the query lane from flooding
+        for encoded_frame in frames:
+            self.own_instance.submit_status_query(encoded_frame,
+                                                  lambda future: self.on_response(request, answered, future))
+            time.sleep(1 / self.frames_per_second)
+        if not answered.wait(self.answer_timeout):
+            self.logger.info('Device inventory: %s status requests without answer', request[0])
+        with self.lock:
+            self.scan = started
+            if full:
+                self.full_scan = started
+            forgotten = self.__forget(started - self.forget_after)
+        if forgotten:
+            self.logger.info('Device inventory: forgot %s', ', '.join(forgotten))
+        self.save()
+        self.publish()
+
+    def on_response(self, request, answered, future):
+        if not future.cancelled() and not future.exception():
+            for frame in future.result():
+                if frame in (self.own_instance.ACK.decode(), self.own_instance.NACK.decode()):
+                    continue
+                own_frame = self.frame_monitor.read_frame(frame)
+                entry = inventory_entry(own_frame) if own_frame else None
+                if entry:
+                    self.__found(*entry)
+        with self.lock:
+            request[0] -= 1
+            if request[0] > 0:
+                return
+        answered.set()
+
+    def publish(self):
+        with self.lock:
+            inventory = {kind: sorted(devices, key=lambda device_id: (len(device_id), device_id))
+                         for kind, devices in self.devices.items()}
+            inventory.update(scan=round(self.scan), full_scan=round(self.full_scan))
+        self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/inventory',
+                                              payload=json.dumps(inventory), qos=0, retain=True)
+
+    def __found(self, kind, device_id):
+        with self.lock:
+            known = device_id in self.devices[kind]
+            self.devices[kind][device_id] = time.time()
+        if not known:
+            self.logger.info('Device inventory: new %s %s', kind, device_id)
+            self.own_instance.add_discovered_device(kind, device_id)
+
+    def __forget(self, oldest):
+        forgotten = []
+        for kind, devices in self.devices.items():
+            for device_id in [device_id for device_id, seen in devices.items() if seen < oldest]:
+                del devices[device_id]
+                forgotten.append(f'{kind} {device_id}')
+        return forgotten
+
+    def __sweep_loop(self):
+        while True:
+            try:
+                # A first run or an old full sweep probes every address, otherwise only the known devices are checked
+                full = not any(self.devices.values()) or time.time() - self.full_scan >= self.full_scan_interval
+                self.sweep(full)
+            except Exception as e:
+                self.logger.info(e)
+            if self.rescan_interval <= 0:
+                return
+            time.sleep(self.rescan_interval)
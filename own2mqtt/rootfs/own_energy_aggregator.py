@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from array import array
+
+
+class OWNRingBuffer:
+    __slots__ = ('times', 'values', 'index', 'size')
+
+    def __init__(self, capacity):
+        # Two flat arrays of doubles, 16 bytes per sample whatever the number of meters
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.index = 0
+        self.size = 0
+
+    def append(self, timestamp, value):
+        self.times[self.index] = timestamp
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.times)
+        if self.size < len(self.times):
+            self.size += 1
+
+    def stats(self, since):
+        # Newest first, stops at the first sample older than the window
+        count = 0
+        total = 0.0
+        minimum = maximum = last = None
+        position = self.index
+        for _ in range(self.size):
+            position = (position - 1) % len(self.times)
+            if self.times[position] < since:
+                break
+            value = self.values[position]
+            if last is None:
+                last = minimum = maximum = value
+            elif value < minimum:
+                minimum = value
+            elif value > maximum:
+                maximum = value
+            total += value
+            count += 1
+        if not count:
+            return None
+        return {'min': minimum, 'max': maximum, 'avg': round(total / count, 3), 'last': last, 'count': count}
+
+
+class OWNEnergyAggregator:
+    def __init__(self, own_instance, windows=(60, 900), publish_interval=60, raw=True, samples=360):
+        self.own_instance = own_instance
+        self.windows = tuple(windows)
+        self.publish_interval = publish_interval
+        # Raw readings are still published one by one unless turned off
+        self.raw = raw
+        self.samples = samples
+
+        self.lock = threading.Lock()
+        # Raw topic -> ring buffer, aggregates go to <raw topic>/<window>s
+        self.buffers = {}
+
+    def record(self, topic, value):
+        now = time.monotonic()
+        with self.lock:
+            buffer = self.buffers.get(topic)
+            if buffer is None:
+                buffer = self.buffers[topic] = OWNRingBuffer(self.samples)
+            buffer.append(now, value)
+
+    def publish(self):
+        now = time.monotonic()
+        with self.lock:
+            aggregates = [(f'{topic}/{window}s', buffer.stats(now - window))
+                          for topic, buffer in self.buffers.items() for window in self.windows]
+        for topic, stats in aggregates:
+            if stats:
+                self.own_instance.state_cache.publish(topic, payload=json.dumps(stats), qos=0, retain=False)
+
+    def start(self):
+        def publish_loop():
+            while True:
+                time.sleep(self.publish_interval)
+                if self.own_instance.mqtt_ready:
+                    self.publish()
+
+        threading.Thread(target=publish_loop, name='energy-aggregator', daemon=True).start()
@@ -0,0 +1,37 @@
+import regex
+
+
+# All frame types in a single anchored pattern, alternatives keep the order of the former regex cascade
+FRAME_REGEX = regex.compile(r"""^\*(?:
+    (?P<who>\d+)\*(?P<what>\d+)(?:\#(?P<what_param>\d+))*\*(?P<where>\d+)(?:\#(?P<where_param>\d+))*\#\#(?P<state_command>)
+    |\#(?P<who>\d+)\*(?P<where>\d+)\#\#(?P<state_request>)
+    |\#(?P<who>\d+)\*(?P<where>\d+(?:\#\d+)?)?\*(?P<dimension>\d+)\*?(?:(?P<dimension_value>\d+)\*?)*\#\#(?P<dimension_request>)
+    |\#(?P<who>\d+)\*(?P<where>\d+)\*\#(?P<dimension>\d+)\*?(?:(?P<dimension_value>\d+)\*?)*\#\#(?P<dimension_write>)
+)$""", regex.VERBOSE)
+
+FRAME_TYPES = ('state_command', 'state_request', 'dimension_request', 'dimension_write')
+
+
+class OWNFrame:
+    __slots__ = ('frame', 'frame_type', 'who', 'what', 'what_param', 'where', 'where_param', 'dimension',
+                 'dimension_value')
+
+    def __init__(self, frame, frame_type, match):
+        self.frame = frame
+        self.frame_type = frame_type
+        self.who = match.group('who')
+        self.what = match.group('what')
+        self.what_param = match.captures('what_param')
+        self.where = match.group('where')
+        self.where_param = match.captures('where_param')
+        self.dimension = match.group('dimension')
+        self.dimension_value = match.captures('dimension_value')
+
+
+def parse_frame(frame):
+    match = FRAME_REGEX.match(frame)
+    if not match:
+        return None
+    for frame_type in FRAME_TYPES:
+        if match.group(frame_type) is not None:
+            return OWNFrame(frame, frame_type, match)
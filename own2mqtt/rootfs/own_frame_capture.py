@@ -0,0 +1,85 @@
+import gzip
+import logging
+import os
+import struct
+import time
+import zlib
+
+
+# File layout: MAGIC, start time (double, epoch seconds), then one record per frame:
+# milliseconds since the previous frame (uint32), frame length (uint16), frame bytes.
+# Every start appends such a session to the same file
+MAGIC = b'OWNCAP1\n'
+START = struct.Struct('<d')
+RECORD = struct.Struct('<IH')
+
+
+def open_capture(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode, buffering=1024 * 1024)
+
+
+class OWNFrameCaptureWriter:
+    def __init__(self, path, max_size=0, flush_interval=1):
+        self.logger = logging.getLogger("own2mqtt")
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        # Appended, a restart must not wipe the frames captured before it. max_size covers the whole file
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.file = open_capture(path, 'ab')
+        self.last_time = time.time()
+        self.last_flush = self.last_time
+        self.file.write(MAGIC)
+        self.file.write(START.pack(self.last_time))
+        self.logger.info('Capturing MONITOR frames to %s', path)
+
+    def write(self, frame):
+        if self.file is None:
+            return
+        now = time.time()
+        encoded_frame = frame.encode()
+        self.file.write(RECORD.pack(max(int((now - self.last_time) * 1000), 0), len(encoded_frame)))
+        self.file.write(encoded_frame)
+        # Only advance by whole milliseconds so rounding does not accumulate over long captures
+        self.last_time += int((now - self.last_time) * 1000) / 1000
+        self.size += RECORD.size + len(encoded_frame)
+        if self.max_size and self.size >= self.max_size:
+            self.logger.info('Capture %s reached %s bytes, stopped', self.path, self.size)
+            self.close()
+        elif now - self.last_flush >= self.flush_interval:
+            self.file.flush()
+            self.last_flush = now
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_capture(path):
+    # Yields (seconds since the previous frame, frame) without loading the capture in memory.
+    # Sessions of later starts are played back to back
+    with open_capture(path, 'rb') as capture_file:
+        if capture_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not an own2mqtt frame capture')
+        capture_file.read(START.size)
+        try:
+            while True:
+                header = capture_file.read(RECORD.size)
+                if header == MAGIC[:RECORD.size]:
+                    capture_file.read(len(MAGIC) - RECORD.size + START.size)
+                    continue
+                if len(header) < RECORD.size:
+                    return
+                delay, length = RECORD.unpack(header)
+                frame = capture_file.read(length)
+                if len(frame) < length:
+                    return
+                yield delay / 1000, frame.decode()
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            # A gzip capture of a process that was killed is never terminated, it ends at its last complete frame
+            return
@@ -1,97 +1,137 @@
 import logging
-from own_frame_monitor import OWNFrameMonitor
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+
+# MQTT topic filter (relative to mqtt_base_topic, the + is the WHERE) -> (WHO, frame builder)
+COMMAND_ROUTES = (
+    ('command_frame', None, 'send_command_frame'),
+    ('who-1/+/command', '1', 'send_light_command'),
+    ('who-2/+/command', '2', 'send_shutter_command'),
+    ('who-2/+/set_position', '2', 'send_shutter_position'),
+    ('who-4/zones/+/mode/set', '4', 'send_thermo_mode'),
+    ('who-4/zones/+/temperature/set', '4', 'send_thermo_temperature'),
+)
+
+LIGHT_COMMANDS = {b'ON': '1', b'OFF': '0'}
+SHUTTER_COMMANDS = {b'STOP': '0', b'OPEN': '1', b'CLOSE': '2'}
+# Heat and cool set the default temperature, off sets "Antifreeze" mode inspite of "Generic OFF"
+THERMO_MODES = {b'heat': '*#4*{where}*#14*0{temperature}*1##', b'cool': '*#4*{where}*#14*0{temperature}*2##',
+                b'off': '*4*303*{where}##'}
+
+
+class OWNCommandRoute:
+    __slots__ = ('topic_filter', 'who', 'builder', 'prefix_length', 'suffix_length')
+
+    def __init__(self, mqtt_base_topic, topic_filter, who, builder):
+        self.topic_filter = f'{mqtt_base_topic}/{topic_filter}'
+        self.who = who
+        self.builder = builder
+        # The WHERE is sliced out of the topic between the parts around the +
+        prefix, _, suffix = self.topic_filter.partition('+')
+        self.prefix_length = len(prefix)
+        self.suffix_length = len(suffix)
+
+    def where(self, topic):
+        if self.who is None:
+            return None
+        return topic[self.prefix_length:len(topic) - self.suffix_length]
+
+
+def command_routes(mqtt_base_topic):
+    return tuple(OWNCommandRoute(mqtt_base_topic, *route) for route in COMMAND_ROUTES)
 
 
 class OWNFrameCommand:
-    def __init__(self, own_instance, topic, payload):
+    def __init__(self, own_instance, topic, payload, route=None):
         self.logger = logging.getLogger("own2mqtt")
 
         self.own_instance = own_instance
         self.topic = topic
         self.payload = payload
-        self.topic_parts = topic.split('/')
         self.frame = None
         self.who = None
         self.where = None
-        self.create_frame()
-
-    def create_frame(self):
-        if self.topic_parts[1] == 'command_frame':
-            self.frame = self.payload
-            self.own_instance.write_socket(self.frame)
-            self.own_instance.read_command_socket()
-
-        elif self.topic_parts[1].startswith('who-'):
-            self.who = self.topic_parts[1].replace('who-', '')
-            if self.who == '1':
-                self.logger.debug('WHO %s' % self.who)
-                self.send_frame_who_1()
-            elif self.who == '2':
-                self.logger.debug('WHO %s' % self.who)
-                self.send_frame_who_2()
-            elif self.who == '4':
-                self.logger.debug('WHO %s' % self.who)
-                self.send_frame_who_4()
-
-    def send_frame_who_1(self):
-        self.where = self.topic_parts[2]
-        if self.payload == b'ON':
-            self.frame = ('*1*1*%s##' % self.where).encode()
-        elif self.payload == b'OFF':
-            self.frame = ('*1*0*%s##' % self.where).encode()
-
-        self.own_instance.write_socket(self.frame)
-        response_frames = self.own_instance.read_command_socket()
-
-        if self.own_instance.ACK.decode() in response_frames:
-            self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/who-1/{self.where}/state',
-                                                  payload=self.payload, qos=1, retain=True)
-
-    def send_frame_who_2(self):
-        self.where = self.topic_parts[2]
-        if self.topic_parts[3] == 'command':
-            if self.payload == b'STOP':
-                self.logger.debug('WHO 2 STOP')
-                self.frame = ('*2*0*%s##' % self.where).encode()
-            elif self.payload == b'OPEN':
-                self.logger.debug('WHO 2 OPEN')
-                self.frame = ('*2*1*%s##' % self.where).encode()
-            elif self.payload == b'CLOSE':
-                self.logger.debug('WHO 2 CLOSE')
-                self.frame = ('*2*2*%s##' % self.where).encode()
-        elif self.topic_parts[3] == 'set_position':
-            self.logger.debug('WHO 2 Set Position')
-            self.frame = ('*#2*%s*#11#001*%s##' % (self.where, self.payload.decode())).encode()
-        self.own_instance.write_socket(self.frame)
-        self.own_instance.read_command_socket()
-
-    def send_frame_who_4(self):
+        self.sent_at = None
+        # (topic, payload) published once the gateway acknowledges the frame
+        self.ack_publish = []
+        if route is None:
+            route = self.find_route()
+        if route is not None:
+            self.who = route.who
+            self.where = route.where(topic)
+            getattr(self, route.builder)()
+
+    def send(self):
+        if self.frame is None:
+            return
+        self.mark_sent()
+        self.own_instance.write_socket(self.frame).add_done_callback(self.on_response)
+
+    def mark_sent(self):
+        self.sent_at = time.perf_counter()
+
+    def on_response(self, future):
+        if future.exception():
+            self.logger.info('%s: %s', self.frame.decode(), future.exception())
+            return
+        self.handle_response(future.result())
+
+    def handle_response(self, response_frames):
+        acknowledged = self.own_instance.ACK.decode() in response_frames
+        if self.sent_at:
+            if acknowledged:
+                result = 'ack'
+            elif self.own_instance.NACK.decode() in response_frames:
+                result = 'nack'
+            else:
+                result = 'other'
+            self.own_instance.metrics.observe('own2mqtt_command_round_trip_seconds', time.perf_counter() - self.sent_at,
+                                              result=result)
+        if acknowledged:
+            for topic, payload in self.ack_publish:
+                self.own_instance.state_cache.publish(topic, payload=payload, qos=1, retain=True)
+
+    def find_route(self):
+        # Only for messages that did not come through a per-topic callback
+        for route in self.own_instance.command_routes:
+            if topic_matches_sub(route.topic_filter, self.topic):
+                return route
+        return None
+
+    def send_command_frame(self):
+        self.frame = self.payload
+
+    def send_light_command(self):
+        what = LIGHT_COMMANDS.get(self.payload)
+        if what is not None:
+            self.frame = f'*1*{what}*{self.where}##'.encode()
+
+        self.ack_publish.append((f'{self.own_instance.mqtt_base_topic}/who-1/{self.where}/state', self.payload))
+
+    def send_shutter_command(self):
+        what = SHUTTER_COMMANDS.get(self.payload)
+        if what is not None:
+            self.logger.debug('WHO 2 %s', self.payload)
+            self.frame = f'*2*{what}*{self.where}##'.encode()
+
+    def send_shutter_position(self):
+        self.logger.debug('WHO 2 Set Position')
+        self.frame = f'*#2*{self.where}*#11#001*{self.payload.decode()}##'.encode()
+
+    def send_thermo_mode(self):
         default_temperature = 21.0
-        default_temperatur_str = int(default_temperature * 10.0)
-        self.where = self.topic_parts[3]
-        if self.topic_parts[4] == 'mode':
-            if self.payload == b'heat':
-                self.logger.debug('WHO 4 - SET HEATING')
-                self.frame = f'*#4*{self.where}*#14*0{default_temperatur_str}*1##'.encode()
-            elif self.payload == b'cool':
-                self.logger.debug('WHO 4 - SET COOL')
-                self.frame = f'*#4*{self.where}*#14*0{default_temperatur_str}*2##'.encode()
-            elif self.payload == b'off':
-                self.logger.debug('WHO 4 - SET OFF')
-                # Set "Antifreeze" mode inspite of "Generic OFF"
-                self.frame = f'*4*303*{self.where}##'.encode()
-            self.own_instance.write_socket(self.frame)
-            response_frames = self.own_instance.read_command_socket()
-
-            if self.own_instance.ACK.decode() in response_frames:
-                self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/who-4/zones/{self.where}/mode/current', payload=self.payload, qos=1, retain=True)
-                self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/who-4/zones/{self.where}/temperature/target', payload=default_temperature, qos=1, retain=True)
-
-        if self.topic_parts[4] == 'temperature':
-            temperature_str = int(float(self.payload.decode()) * 10.0)
-            self.frame = f'*#4*{self.where}*#14*0{temperature_str}*3##'.encode()
-            self.own_instance.write_socket(self.frame)
-            response_frames = self.own_instance.read_command_socket()
-
-            if self.own_instance.ACK.decode() in response_frames:
-                self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/who-4/zones/{self.where}/temperature/target', payload=self.payload, qos=1, retain=True)
\ No newline at end of file
+        frame = THERMO_MODES.get(self.payload)
+        if frame is not None:
+            self.logger.debug('WHO 4 - SET %s', self.payload)
+            self.frame = frame.format(where=self.where, temperature=int(default_temperature * 10.0)).encode()
+
+        self.ack_publish.append((f'{self.own_instance.mqtt_base_topic}/who-4/zones/{self.where}/mode/current', self.payload))
+        self.ack_publish.append((f'{self.own_instance.mqtt_base_topic}/who-4/zones/{self.where}/temperature/target', default_temperature))
+
+    def send_thermo_temperature(self):
+        temperature_str = int(float(self.payload.decode()) * 10.0)
+        self.frame = f'*#4*{self.where}*#14*0{temperature_str}*3##'.encode()
+
+        self.ack_publish.append((f'{self.own_instance.mqtt_base_topic}/who-4/zones/{self.where}/temperature/target', self.payload))
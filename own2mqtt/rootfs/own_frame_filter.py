@@ -0,0 +1,88 @@
+import logging
+
+from own_frame import FRAME_TYPES
+
+
+class OWNFilterRule:
+    __slots__ = ('rule', 'allow', 'prefixes', 'frame_type', 'where_range', 'dropped')
+
+    def __init__(self, rule):
+        # "<allow|deny> [who=1,2] [type=dimension_write] [where=11-19]", the first matching rule wins
+        self.rule = rule
+        action, *conditions = rule.split()
+        if action not in ('allow', 'deny'):
+            raise ValueError(f'Frame filter rule must start with allow or deny: {rule}')
+        self.allow = action == 'allow'
+        self.frame_type = None
+        self.where_range = None
+        whos = None
+        for condition in conditions:
+            key, _, value = condition.partition('=')
+            if key == 'who':
+                whos = value.split(',')
+            elif key == 'type' and value in FRAME_TYPES:
+                self.frame_type = value
+            elif key == 'where':
+                first, _, last = value.partition('-')
+                self.where_range = (int(first), int(last or first))
+            else:
+                raise ValueError(f'Unknown frame filter condition {condition} in {rule}')
+        # WHO and STATE_COMMAND vs the other frame types are told apart by the frame prefix alone
+        if whos is None:
+            if self.frame_type is None:
+                self.prefixes = ('*',)
+            elif self.frame_type == 'state_command':
+                self.prefixes = tuple(f'*{digit}' for digit in '0123456789')
+            else:
+                self.prefixes = ('*#',)
+        elif self.frame_type == 'state_command':
+            self.prefixes = tuple(f'*{who}*' for who in whos)
+        elif self.frame_type:
+            self.prefixes = tuple(f'*#{who}*' for who in whos)
+        else:
+            self.prefixes = tuple(f'*{who}*' for who in whos) + tuple(f'*#{who}*' for who in whos)
+        self.dropped = 0
+
+    def matches(self, frame):
+        if not frame.startswith(self.prefixes):
+            return False
+        if self.frame_type is None and self.where_range is None:
+            return True
+        frame_type, where = frame_header(frame)
+        if self.frame_type is not None and frame_type != self.frame_type:
+            return False
+        if self.where_range is not None:
+            where = where.split('#', 1)[0]
+            return where.isdigit() and self.where_range[0] <= int(where) <= self.where_range[1]
+        return True
+
+
+def frame_header(frame):
+    # (frame type, WHERE) from the field layout, without running the full frame regex
+    fields = frame[1:-2].split('*')
+    if fields[0].startswith('#'):
+        where = fields[1] if len(fields) > 1 else ''
+        if len(fields) == 2:
+            return 'state_request', where
+        return ('dimension_write' if fields[2].startswith('#') else 'dimension_request'), where
+    return 'state_command', fields[2] if len(fields) > 2 else ''
+
+
+class OWNFrameFilter:
+    def __init__(self, rules):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.rules = [OWNFilterRule(rule) for rule in rules]
+        self.logger.info('Frame filter: %s', '; '.join(rule.rule for rule in self.rules))
+
+    def allow(self, frame):
+        for rule in self.rules:
+            if rule.matches(frame):
+                if not rule.allow:
+                    rule.dropped += 1
+                return rule.allow
+        return True
+
+    def metrics_gauges(self):
+        return {('own2mqtt_filtered_frames', (('rule', rule.rule),)): rule.dropped for rule in self.rules
+                if not rule.allow}
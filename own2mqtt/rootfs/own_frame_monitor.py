@@ -1,314 +1,7 @@
-import regex
 import logging
-from time import time
 from datetime import datetime, timedelta
 
-
-class OWNFrameMonitor:
-    def __init__(self, frame, own_instance):
-        self.logger = logging.getLogger("own2mqtt")
-
-        self.frame = frame
-        self.frame_type = None
-        self.who = None
-        self.what = None
-        self.what_param = None
-        self.where = None
-        self.where_param = None
-        self.dimension = None
-        self.dimension_value = None
-        self.dimension_list = {}
-        self.own_instance = own_instance
-        self.mqtt_client = own_instance.mqtt_client
-        self.mqtt_base_topic = own_instance.mqtt_base_topic
-        self.read_frame()
-
-    def read_frame(self):
-        state_command_regex = r"^\*(?P<who>\d+)\*(?P<what>\d+)(#(?P<what_param>\d+))*\*(?P<where>\d+)(#(?P<where_param>\d+))*##$"
-        state_command_match = regex.search(state_command_regex, self.frame)
-        if state_command_match:
-            self.type_state_command(state_command_match)
-        else:
-            state_request_regex = r"^\*#(?P<who>\d+)\*(?P<where>\d+)##$"
-            state_request_match = regex.search(state_request_regex, self.frame)
-            if state_request_match:
-                self.type_state_request(state_request_match)
-            else:
-                dimension_request_regex = r"^\*#(?P<who>\d+)\*(?P<where>\d+(#\d+)?)?\*(?P<dimension>\d+)\*?((?P<dimension_value>\d+)\*?)*##$"
-                dimension_request_match = regex.search(dimension_request_regex, self.frame)
-                if dimension_request_match:
-                    self.type_dimension_request(dimension_request_match)
-                else:
-                    dimension_write_regex = r"^\*#(?P<who>\d+)\*(?P<where>\d+)\*#(?P<dimension>\d+)\*?((?P<dimension_value>\d+)\*?)*##$"
-                    dimension_write_match = regex.search(dimension_write_regex, self.frame)
-                    if dimension_write_match:
-                        self.type_dimension_write(dimension_write_match)
-                    else:
-                        self.logger.debug('RX: %s', self.frame)
-
-    def type_state_command(self, match):
-        self.frame_type = 'state_command'
-        self.who = match.group('who')
-        self.what = match.group('what')
-        self.what_param = match.captures('what_param')
-        self.where = match.group('where')
-        self.where_param = match.captures('where_param')
-        self.logger.debug(self.__explain_state_command_frame())
-
-        if self.who == '1':
-            self.mqtt_state_command_who_1()
-        elif self.who == '2':
-            self.mqtt_state_command_who_2()
-        elif self.who == '4':
-            self.mqtt_state_command_who_4()
-        elif self.who == '25':
-            self.mqtt_state_command_who_25()
-
-    def type_state_request(self, match):
-        self.frame_type = 'state_request'
-        self.who = match.group('who')
-        self.where = match.group('where')
-        self.logger.debug(self.__explain_state_request_frame())
-
-    def type_dimension_request(self, match):
-        self.frame_type = 'dimension_request'
-        self.who = match.group('who')
-        self.where = match.group('where')
-        self.dimension = match.group('dimension')
-        self.dimension_value = match.captures('dimension_value')
-
-        if self.who == '1':
-            self.mqtt_dimension_request_who_1()
-        elif self.who == '2':
-            self.mqtt_dimension_request_who_2()
-        elif self.who == '4':
-            self.mqtt_dimension_request_who_4()
-        elif self.who == '13':
-            self.mqtt_dimension_request_who_13()
-        elif self.who == '18':
-            self.mqtt_dimension_request_who_18()
-
-    def type_dimension_write(self, match):
-        self.frame_type = 'dimension_write'
-        self.who = match.group('who')
-        self.where = match.group('where')
-        self.dimension = match.group('dimension')
-        self.dimension_value = match.captures('dimension_value')
-
-        self.__explain_dimension_write_frame()
-
-    def mqtt_state_command_who_1(self):
-        if self.what == '34':
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-1/{self.where}/presence", payload='ON', qos=1,
-                                     retain=False)
-        else:
-            if self.what == '1':
-                state = 'ON'
-            elif self.what == '0':
-                state = 'OFF'
-            else:
-                state = self.what
-                self.logger.debug(self.__explain_state_command_frame())
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-1/{self.where}/state", payload=state, qos=1,
-                                     retain=True)
-
-    def mqtt_state_command_who_2(self):
-        if self.what == '1000':
-            if self.what_param == ['0']:
-                state = 'stopped'
-            elif self.what_param == ['1']:
-                state = 'opening'
-            elif self.what_param == ['2']:
-                state = 'closing'
-            else:
-                state = self.what_param
-                self.logger.debug(self.__explain_state_command_frame())
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-2/{self.where}/state", payload=state, qos=1,
-                                     retain=True)
-
-    def mqtt_state_command_who_4(self):
-        if self.what == '4002':
-            return
-        else:
-            if self.what == '1':
-                mode = 'heat'
-            elif self.what == '0':
-                mode = 'cool'
-            else:
-                mode = 'off'
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-4/zones/{self.where}/mode/current", payload=mode,
-                                     qos=1, retain=True)
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-4/zones/{self.where}/mode/raw", payload=self.what,
-                                     qos=1, retain=True)
-
-    def mqtt_state_command_who_25(self):
-        if self.what == '21':
-            pressure = 'short'
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-25/{self.where}/{self.what_param[0]}/short",
-                                     payload='on', qos=1, retain=False)
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-25/{self.where}/{self.what_param[0]}/short",
-                                     payload='off', qos=1, retain=False)
-        elif self.what == '22':
-            pressure = 'startextend'
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-25/{self.where}/{self.what_param[0]}/long",
-                                     payload='on', qos=1, retain=False)
-        elif self.what == '23':
-            pressure = 'extend'
-        elif self.what == '24':
-            pressure = 'endextend'
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-25/{self.where}/{self.what_param[0]}/long",
-                                     payload='off', qos=1, retain=False)
-        else:
-            pressure = self.what
-            self.logger.debug(self.__explain_state_command_frame())
-        self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-25/{pressure}",
-                                 payload=f"{self.where}-{self.what_param[0]}", qos=1,
-                                 retain=False)
-
-    def mqtt_dimension_request_who_1(self):
-        self.dimension_list = {
-            'lightIntesity': self.dimension_value[0]
-        }
-
-        if self.dimension == '6':
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-1/{self.where}/light",
-                                     payload=self.dimension_list['lightIntesity'], qos=1, retain=False)
-
-        self.logger.debug(self.__explain_dimension_request_frame())
-
-    def mqtt_dimension_request_who_2(self):
-        self.dimension_list = {
-            'shutterStatus': self.dimension_value[0],
-            'shutterLevel': self.dimension_value[1],
-            'shutterPriority': self.dimension_value[2],
-            'shutterInfo': self.dimension_value[3]
-        }
-
-        if self.dimension_list['shutterStatus'] == '10':
-            state = 'stopped'
-        elif self.dimension_list['shutterStatus'] == '11':
-            state = 'opening'
-        elif self.dimension_list['shutterStatus'] == '12':
-            state = 'closing'
-        else:
-            state = self.dimension_list['shutterStatus']
-
-        self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-2/{self.where}/position",
-                                 payload=self.dimension_list['shutterLevel'],
-                                 qos=1, retain=True)
-        self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-2/{self.where}/state", payload=state, qos=1, retain=True)
-
-        self.logger.debug(self.__explain_dimension_request_frame())
-
-    def mqtt_dimension_request_who_4(self):
-        if self.dimension == '0':
-            temperature = str_temp_to_float(self.dimension_value[0])
-            self.dimension_list = {
-                'temperature': temperature,
-            }
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-4/zones/{self.where}/temperature/current",
-                                     payload=self.dimension_list['temperature'], qos=1, retain=True)
-        if self.dimension == '12':
-            temperature = str_temp_to_float(self.dimension_value[0])
-            self.dimension_list = {
-                'target_temperature': temperature,
-            }
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-4/zones/{self.where}/temperature/target",
-                                     payload=self.dimension_list['target_temperature'], qos=1, retain=True)
-        if self.dimension == '14':
-            temperature = str_temp_to_float(self.dimension_value[0])
-            self.dimension_list = {
-                'target_temperature': temperature,
-            }
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-4/zones/{self.where}/temperature/target",
-                                     payload=self.dimension_list['target_temperature'], qos=1, retain=True)
-        if self.dimension == '19':
-            self.dimension_list = {
-                'conditioning': int(self.dimension_value[0]),
-                'status': int(self.dimension_value[1]),
-            }
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-4/valves/{self.where}/conditioning",
-                                     payload=self.dimension_list['conditioning'], qos=1, retain=True)
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-4/valves/{self.where}/status",
-                                     payload=self.dimension_list['status'], qos=1, retain=True)
-        if self.dimension == '20':
-            zone, actuator = self.where.split('#')
-            self.dimension_list = {
-                'status': int(self.dimension_value[0])
-            }
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-4/actuators/{actuator}/{zone}/status",
-                                     payload=self.dimension_list['status'], qos=1, retain=True)
-        if self.dimension == '60':
-            humidity = str_humi_to_float(self.dimension_value[0])
-            self.dimension_list = {
-                'humidity': humidity,
-            }
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-4/zones/{self.where}/humidity/current",
-                                     payload=self.dimension_list['humidity'], qos=1, retain=True)
-        self.logger.debug(self.__explain_dimension_request_frame())
-
-    def mqtt_dimension_request_who_13(self):
-        if self.dimension == '19':
-            self.dimension_list = {
-                'days': int(self.dimension_value[0]),
-                'hours': int(self.dimension_value[1]),
-                'minutes': int(self.dimension_value[2]),
-                'seconds': int(self.dimension_value[3]),
-            }
-            received_uptime = timedelta(days=self.dimension_list['days'], hours=self.dimension_list['hours'], minutes=self.dimension_list['minutes'], seconds=self.dimension_list['seconds'])
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-13/uptime", payload=received_uptime.total_seconds(), qos=1, retain=False)
-        if self.dimension == '22':
-            self.dimension_list = {
-                'hours': int(self.dimension_value[0]),
-                'minutes': int(self.dimension_value[1]),
-                'seconds': int(self.dimension_value[2]),
-                'time_zone': int(self.dimension_value[3]),
-                'day_of_week': int(self.dimension_value[4]),
-                'day': int(self.dimension_value[5]),
-                'month': int(self.dimension_value[6]),
-                'year': int(self.dimension_value[7]),
-            }
-            received_datetime = datetime(self.dimension_list['year'], self.dimension_list['month'], self.dimension_list['day'], self.dimension_list['hours'], self.dimension_list['minutes'], self.dimension_list['seconds'])
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-13/datetime", payload=received_datetime.isoformat(), qos=1, retain=False)
-        self.logger.debug(self.__explain_dimension_request_frame())
-
-    def mqtt_dimension_request_who_18(self):
-        self.where = self.where.replace('#0', '')
-        if self.dimension == '51':
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-18/{self.where}/total_energy",
-                                     payload=self.dimension_value[0], qos=1,
-                                     retain=True)
-        if self.dimension == '53':
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-18/{self.where}/current_month_energy",
-                                     payload=self.dimension_value[0], qos=1,
-                                     retain=True)
-        if self.dimension == '54':
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-18/{self.where}/current_day_energy",
-                                     payload=self.dimension_value[0], qos=1,
-                                     retain=True)
-        if self.dimension == '72':
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-18/{self.where}/current_day_energy",
-                                     payload=self.dimension_value[0], qos=1,
-                                     retain=True)
-        if self.dimension == '113':
-            self.mqtt_client.publish(f"{self.mqtt_base_topic}/who-18/{self.where}/active_power",
-                                     payload=self.dimension_value[0], qos=1,
-                                     retain=False)
-
-    def __explain_state_command_frame(self):
-        return "RX: %s (TYPE: STATE_COMMAND | WHO: %s | WHAT: %s | WHAT_PARAM: %s | WHERE: %s | WHERE_PARAM: %s)" % (
-            self.frame, self.who, self.what, ', '.join(self.what_param), self.where, ', '.join(self.where_param))
-
-    def __explain_state_request_frame(self):
-        return "RX: %s (TYPE: STATE_REQUEST | WHO: %s | WHERE: %s)" % (self.frame, self.who, self.where)
-
-    def __explain_dimension_request_frame(self):
-        return "RX: %s (TYPE: DIMENSION_REQUEST | WHO: %s | WHERE: %s | DIMENSION: %s | DIMENSION_VALUE: %s)" % (
-            self.frame, self.who, self.where, self.dimension, self.dimension_list)
-
-    def __explain_dimension_write_frame(self):
-        return "RX: %s (TYPE: DIMENSION_WRITE | WHO: %s | WHERE: %s | DIMENSION: %s | DIMENSION_VALUE: %s)" % (
-            self.frame, self.who, self.where, self.dimension, ', '.join(self.dimension_value))
+from own_frame import parse_frame
 
 
 def str_temp_to_float(temp_str):
@@ -319,3 +12,172 @@ def str_temp_to_float(temp_str):
 def str_humi_to_float(humi_str):
     humi_float = int(humi_str) / 1.0
     return humi_float
+
+
+# (frame type, WHO, WHAT or DIMENSION) -> (handler, topic templates, retain, handler argument)
+# None as WHAT/DIMENSION matches anything not listed for that WHO, a None route drops the frame.
+# Topic templates are relative to mqtt_base_topic: {0} is the WHERE, {1}, {2}... its '#' separated parts.
+ROUTES = {
+    ('state_command', '1', '34'): ('publish_constant', ('who-1/{0}/presence',), False, 'ON'),
+    ('state_command', '1', None): ('publish_state', ('who-1/{0}/state',), True, {'1': 'ON', '0': 'OFF'}),
+    ('state_command', '2', '1000'): ('publish_shutter_state', ('who-2/{0}/state',), True,
+                                     {'0': 'stopped', '1': 'opening', '2': 'closing'}),
+    ('state_command', '4', '4002'): None,
+    ('state_command', '4', None): ('publish_thermo_mode', ('who-4/zones/{0}/mode/current', 'who-4/zones/{0}/mode/raw'),
+                                   True, {'1': 'heat', '0': 'cool'}),
+    ('state_command', '25', '21'): ('publish_button', ('who-25/{1}/{2}/short', 'who-25/short'), False, ('on', 'off')),
+    ('state_command', '25', '22'): ('publish_button', ('who-25/{1}/{2}/long', 'who-25/startextend'), False, ('on',)),
+    ('state_command', '25', '23'): ('publish_button', ('who-25/extend',), False, ()),
+    ('state_command', '25', '24'): ('publish_button', ('who-25/{1}/{2}/long', 'who-25/endextend'), False, ('off',)),
+    ('state_command', '25', None): ('publish_button', ('who-25/{3}',), False, ()),
+    ('dimension_request', '1', '6'): ('publish_value', ('who-1/{0}/light',), False, None),
+    ('dimension_request', '2', None): ('publish_shutter_status', ('who-2/{0}/position', 'who-2/{0}/state'), True,
+                                       {'10': 'stopped', '11': 'opening', '12': 'closing'}),
+    ('dimension_request', '4', '0'): ('publish_value', ('who-4/zones/{0}/temperature/current',), True,
+                                      str_temp_to_float),
+    ('dimension_request', '4', '12'): ('publish_value', ('who-4/zones/{0}/temperature/target',), True,
+                                       str_temp_to_float),
+    ('dimension_request', '4', '14'): ('publish_value', ('who-4/zones/{0}/temperature/target',), True,
+                                       str_temp_to_float),
+    ('dimension_request', '4', '19'): ('publish_value', ('who-4/valves/{0}/conditioning', 'who-4/valves/{0}/status'),
+                                       True, int),
+    ('dimension_request', '4', '20'): ('publish_value', ('who-4/actuators/{2}/{1}/status',), True, int),
+    ('dimension_request', '4', '60'): ('publish_value', ('who-4/zones/{0}/humidity/current',), True,
+                                       str_humi_to_float),
+    ('dimension_request', '13', '19'): ('publish_uptime', ('who-13/uptime',), False, None),
+    ('dimension_request', '13', '22'): ('publish_datetime', ('who-13/datetime',), False, None),
+    ('dimension_request', '18', '51'): ('aggregate_value', ('who-18/{1}/total_energy',), True, None),
+    ('dimension_request', '18', '53'): ('publish_value', ('who-18/{1}/current_month_energy',), True, None),
+    ('dimension_request', '18', '54'): ('publish_value', ('who-18/{1}/current_day_energy',), True, None),
+    ('dimension_request', '18', '72'): ('publish_value', ('who-18/{1}/current_day_energy',), True, None),
+    ('dimension_request', '18', '113'): ('aggregate_value', ('who-18/{1}/active_power',), False, None),
+}
+
+MISSING = object()
+
+
+class OWNRoute:
+    __slots__ = ('handler', 'templates', 'retain', 'arg', 'topics')
+
+    def __init__(self, handler, templates, retain, arg):
+        self.handler = handler
+        self.templates = templates
+        self.retain = retain
+        self.arg = arg
+        # WHERE -> resolved topics, built the first time a WHERE is seen
+        self.topics = {}
+
+    def resolve(self, where):
+        topics = self.topics.get(where)
+        if topics is None:
+            parts = where.split('#')
+            topics = self.topics[where] = tuple(template.format(where, *parts) for template in self.templates)
+        return topics
+
+
+class OWNFrameMonitor:
+    __slots__ = ('logger', 'own_instance', 'publisher', 'mqtt_base_topic', 'routes', 'aggregator', 'trace_sample',
+                 'frame_count', 'trace')
+
+    def __init__(self, own_instance):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        # Change-only publishing, unchanged values are dropped by the state cache
+        self.publisher = own_instance.state_cache
+        self.mqtt_base_topic = own_instance.mqtt_base_topic
+        self.routes = {}
+        for key, route in ROUTES.items():
+            if route is not None:
+                handler, templates, retain, arg = route
+                route = OWNRoute(getattr(self, handler), tuple(f'{self.mqtt_base_topic}/{template}' for template in templates),
+                                 retain, arg)
+            self.routes[key] = route
+        self.aggregator = own_instance.energy_aggregator
+        # Frame explanations are only built for traced frames, 1 out of trace_sample when DEBUG is enabled
+        self.trace_sample = own_instance.log_frame_sample
+        self.frame_count = 0
+        self.trace = False
+
+    def read_frame(self, raw_frame):
+        self.frame_count += 1
+        self.trace = self.frame_count % self.trace_sample == 0 and self.logger.isEnabledFor(logging.DEBUG)
+        frame = parse_frame(raw_frame)
+        if frame is None:
+            if self.trace:
+                self.logger.debug('RX: %s', raw_frame)
+            return None
+
+        route = self.routes.get((frame.frame_type, frame.who, frame.what or frame.dimension), MISSING)
+        if route is MISSING:
+            route = self.routes.get((frame.frame_type, frame.who, None))
+        if route is not None:
+            route.handler(frame, route)
+
+        if self.trace:
+            self.logger.debug(self.__explain_frame(frame))
+        return frame
+
+    def publish_constant(self, frame, route):
+        self.publisher.publish(route.resolve(frame.where)[0], payload=route.arg, qos=1, retain=route.retain)
+
+    def publish_state(self, frame, route):
+        self.publisher.publish(route.resolve(frame.where)[0], payload=route.arg.get(frame.what, frame.what), qos=1,
+                               retain=route.retain)
+
+    def publish_shutter_state(self, frame, route):
+        what_param = '#'.join(frame.what_param)
+        self.publisher.publish(route.resolve(frame.where)[0], payload=route.arg.get(what_param, what_param), qos=1,
+                               retain=route.retain)
+
+    def publish_thermo_mode(self, frame, route):
+        mode_topic, raw_topic = route.resolve(frame.where)
+        self.publisher.publish(mode_topic, payload=route.arg.get(frame.what, 'off'), qos=1, retain=route.retain)
+        self.publisher.publish(raw_topic, payload=frame.what, qos=1, retain=route.retain)
+
+    def publish_button(self, frame, route):
+        # Resolved as WHERE#button#WHAT, templates get the WHERE as {1}, the button as {2} and the pressure as {3}
+        topics = route.resolve(f'{frame.where}#{frame.what_param[0]}#{frame.what}')
+        for payload in route.arg:
+            self.publisher.publish(topics[0], payload=payload, qos=1, retain=route.retain)
+        self.publisher.publish(topics[-1], payload=f"{frame.where}-{frame.what_param[0]}", qos=1, retain=route.retain)
+
+    def publish_value(self, frame, route):
+        convert = route.arg
+        for topic, value in zip(route.resolve(frame.where), frame.dimension_value):
+            self.publisher.publish(topic, payload=convert(value) if convert else value, qos=1, retain=route.retain)
+
+    def aggregate_value(self, frame, route):
+        if self.aggregator is not None:
+            self.aggregator.record(route.resolve(frame.where)[0], float(frame.dimension_value[0]))
+            if not self.aggregator.raw:
+                return
+        self.publish_value(frame, route)
+
+    def publish_shutter_status(self, frame, route):
+        position_topic, state_topic = route.resolve(frame.where)
+        status, level = frame.dimension_value[0], frame.dimension_value[1]
+        self.publisher.publish(position_topic, payload=level, qos=1, retain=route.retain)
+        self.publisher.publish(state_topic, payload=route.arg.get(status, status), qos=1, retain=route.retain)
+
+    def publish_uptime(self, frame, route):
+        days, hours, minutes, seconds = (int(value) for value in frame.dimension_value[:4])
+        received_uptime = timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+        self.publisher.publish(route.templates[0], payload=received_uptime.total_seconds(), qos=1, retain=route.retain)
+
+    def publish_datetime(self, frame, route):
+        hours, minutes, seconds, time_zone, day_of_week, day, month, year = (int(value) for value in
+                                                                             frame.dimension_value[:8])
+        received_datetime = datetime(year, month, day, hours, minutes, seconds)
+        self.publisher.publish(route.templates[0], payload=received_datetime.isoformat(), qos=1, retain=route.retain)
+
+    def __explain_frame(self, frame):
+        if frame.frame_type == 'state_command':
+            return "RX: %s (TYPE: STATE_COMMAND | WHO: %s | WHAT: %s | WHAT_PARAM: %s | WHERE: %s | WHERE_PARAM: %s)" % (
+                frame.frame, frame.who, frame.what, ', '.join(frame.what_param), frame.where,
+                ', '.join(frame.where_param))
+        if frame.frame_type == 'state_request':
+            return "RX: %s (TYPE: STATE_REQUEST | WHO: %s | WHERE: %s)" % (frame.frame, frame.who, frame.where)
+        return "RX: %s (TYPE: %s | WHO: %s | WHERE: %s | DIMENSION: %s | DIMENSION_VALUE: %s)" % (
+            frame.frame, frame.frame_type.upper(), frame.who, frame.where, frame.dimension,
+            ', '.join(frame.dimension_value))
@@ -0,0 +1,39 @@
+import regex
+
+
+FRAME_REGEX = regex.compile(rb"\*#?[\d\*]*#?0?[\d\*]+#?[\d\*]*##")
+FRAME_END = b'##'
+
+
+class OWNFrameReader:
+    def __init__(self, current_socket=None, chunk_size=4096):
+        self.socket = current_socket
+        self.buffer = bytearray()
+        self.chunk = bytearray(chunk_size)
+        self.chunk_view = memoryview(self.chunk)
+
+    def read_frames(self):
+        # Block until at least one complete frame is available, partial frames stay buffered for the next call
+        while True:
+            frames = self.pop_frames()
+            if frames:
+                return frames
+            self.__fill()
+
+    def feed(self, data):
+        if not data:
+            raise ConnectionResetError('OpenWebNet gateway closed the connection')
+        self.buffer += data
+
+    def __fill(self):
+        received = self.socket.recv_into(self.chunk)
+        self.feed(self.chunk_view[:received])
+
+    def pop_frames(self):
+        end = self.buffer.rfind(FRAME_END)
+        if end < 0:
+            return []
+        end += len(FRAME_END)
+        frames = FRAME_REGEX.findall(self.buffer, 0, end)
+        del self.buffer[:end]
+        return [frame.decode() for frame in frames]
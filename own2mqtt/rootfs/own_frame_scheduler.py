@@ -0,0 +1,138 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class OWNFrameScheduler:
+    # Lanes in priority order, interactive commands always go before polling
+    COMMAND = 0
+    QUERY = 1
+    LANE_NAMES = ('command', 'query')
+
+    def __init__(self, own_instance, frames_per_second=10, queue_size=100, stats_interval=60):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        self.interval = 1.0 / frames_per_second if frames_per_second > 0 else 0
+        self.queue_size = queue_size
+        self.stats_interval = stats_interval
+
+        self.lanes = (deque(), deque())
+        self.pending = {}
+        # Query key -> callbacks waiting for its response, a coalesced query answers all of them
+        self.callbacks = {}
+        self.condition = threading.Condition()
+        self.next_send = 0
+        self.next_stats = 0
+        self.counters = {'sent': 0, 'coalesced': 0, 'dropped': 0, 'failed': 0}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def submit_command(self, command):
+        if command.frame is None:
+            return
+        # Only repeated values for the same topic are coalesced, mode and setpoint of one zone are two commands.
+        # Raw command_frame messages have no WHO/WHERE and are never coalesced
+        key = ('command', command.topic) if command.who and command.where else object()
+        self.__submit(self.COMMAND, key, lambda: self.own_instance.execute_command(command))
+
+    def submit_query(self, encoded_frame, callback=None):
+        # callback gets the future of the response frames
+        key = ('query', encoded_frame)
+        with self.condition:
+            if callback is not None:
+                self.callbacks.setdefault(key, []).append(callback)
+            dropped = self.__submit(self.QUERY, key, lambda: self.__send_query(key, encoded_frame))
+        self.__fail_callbacks(dropped, ConnectionError('Query dropped, the scheduler queue is full'))
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.counters)
+            for lane_name, lane in zip(self.LANE_NAMES, self.lanes):
+                stats[f'{lane_name}_queue'] = len(lane)
+        return stats
+
+    def __submit(self, lane_index, key, action):
+        # Returns the callbacks of a dropped query, to be failed outside the lock
+        dropped = []
+        with self.condition:
+            if key in self.pending:
+                # Keep the queue position, only the latest value is sent
+                self.pending[key] = action
+                self.counters['coalesced'] += 1
+                return dropped
+            lane = self.lanes[lane_index]
+            if len(lane) >= self.queue_size:
+                dropped_key = lane.popleft()
+                del self.pending[dropped_key]
+                dropped = self.callbacks.pop(dropped_key, [])
+                self.counters['dropped'] += 1
+            lane.append(key)
+            self.pending[key] = action
+            self.condition.notify()
+        return dropped
+
+    def __send_query(self, key, encoded_frame):
+        with self.condition:
+            callbacks = self.callbacks.pop(key, [])
+        try:
+            future = self.own_instance.write_socket(encoded_frame)
+        except Exception as e:
+            self.__fail_callbacks(callbacks, e)
+            raise
+        for callback in callbacks:
+            future.add_done_callback(callback)
+
+    @staticmethod
+    def __fail_callbacks(callbacks, exception):
+        if not callbacks:
+            return
+        future = Future()
+        future.set_exception(exception)
+        for callback in callbacks:
+            future.add_done_callback(callback)
+
+    def __next_action(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait(self.__stats_timeout())
+                self.__publish_stats()
+        # Protect the gateway, then take whatever is most urgent once the slot is free
+        delay = self.next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        with self.condition:
+            for lane in self.lanes:
+                if lane:
+                    return self.pending.pop(lane.popleft())
+
+    def __run(self):
+        while True:
+            action = self.__next_action()
+            try:
+                action()
+                self.counters['sent'] += 1
+            except Exception as e:
+                self.counters['failed'] += 1
+                self.logger.info(e)
+            self.next_send = time.monotonic() + self.interval
+            self.__publish_stats()
+
+    def __stats_timeout(self):
+        if self.stats_interval <= 0:
+            return None
+        return max(self.next_stats - time.monotonic(), 0)
+
+    def __publish_stats(self):
+        if self.stats_interval <= 0 or time.monotonic() < self.next_stats:
+            return
+        self.next_stats = time.monotonic() + self.stats_interval
+        if self.own_instance.mqtt_ready:
+            self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/scheduler/stats',
+                                                  payload=json.dumps(self.stats()), qos=0, retain=False)
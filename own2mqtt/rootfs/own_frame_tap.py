@@ -0,0 +1,83 @@
+import json
+import threading
+import time
+
+
+# Relative to mqtt_base_topic
+FRAME_TAP_DUMP_TOPIC = 'frame_tap/dump'
+
+
+class OWNFrameTap:
+    MODES = ('off', 'sampled', 'batched')
+
+    def __init__(self, own_instance, mode='sampled', sample=1, batch_frames=100, batch_interval_ms=1000, buffer_size=1000):
+        self.own_instance = own_instance
+        if mode not in self.MODES:
+            raise ValueError(f'Frame tap mode must be one of {self.MODES}: {mode}')
+        # off: only the ring buffer, sampled: 1 out of sample frames to last_frame,
+        # batched: JSON arrays of [time, frame] every batch_frames frames or batch_interval_ms
+        self.mode = mode
+        self.sample = max(sample, 1)
+        self.batch_frames = batch_frames
+        self.batch_interval = batch_interval_ms / 1000
+        self.last_frame_topic = f'{own_instance.mqtt_base_topic}/last_frame'
+        self.batch_topic = f'{own_instance.mqtt_base_topic}/frame_tap/batch'
+
+        # The last buffer_size frames as (time, frame), always kept for dumps whatever the mode
+        self.lock = threading.Lock()
+        self.frames = [None] * buffer_size
+        self.index = 0
+        self.count = 0
+        self.pending = 0
+
+    def start(self):
+        if self.mode == 'batched':
+            threading.Thread(target=self.__flush_loop, name='frame-tap', daemon=True).start()
+
+    def record(self, frame):
+        with self.lock:
+            self.frames[self.index] = (time.time(), frame)
+            self.index = (self.index + 1) % len(self.frames)
+            self.count += 1
+            self.pending += 1
+            count = self.count
+            pending = self.pending
+        if self.mode == 'sampled':
+            if count % self.sample == 0:
+                self.own_instance.mqtt_client.publish(self.last_frame_topic, payload=frame, qos=0, retain=False)
+        elif self.mode == 'batched' and pending >= self.batch_frames:
+            self.flush()
+
+    def latest(self, limit=None):
+        # Oldest first
+        with self.lock:
+            return self.__latest(limit)
+
+    def flush(self):
+        with self.lock:
+            frames = self.__latest(self.pending)
+            self.pending = 0
+        if frames and self.own_instance.mqtt_ready:
+            self.own_instance.mqtt_client.publish(self.batch_topic, payload=json.dumps(frames), qos=0, retain=False)
+
+    def dump(self, payload):
+        # Payload: how many of the last frames, everything buffered when empty
+        try:
+            limit = int(payload) if payload and payload.strip() else None
+        except ValueError:
+            limit = None
+        self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/{FRAME_TAP_DUMP_TOPIC}/result',
+                                              payload=json.dumps(self.latest(limit)), qos=0, retain=False)
+
+    def __latest(self, limit):
+        size = min(self.count, len(self.frames))
+        if limit is not None:
+            size = min(size, limit)
+        start = self.index - size
+        entries = self.frames[start:self.index] if start >= 0 else self.frames[start:] + self.frames[:self.index]
+        return [[round(timestamp, 3), frame] for timestamp, frame in entries]
+
+    def __flush_loop(self):
+        while True:
+            time.sleep(self.batch_interval)
+            self.flush()
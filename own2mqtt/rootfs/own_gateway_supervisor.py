@@ -0,0 +1,104 @@
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from own_logging import setup_logging
+
+
+def run_gateway(options, log_dir, log_name='app'):
+    setup_logging(options['log_level'], log_dir, log_name)
+    # The add-on and the workers are stopped with SIGTERM, raised as SystemExit so the engines close their files
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # Imported here so the supervisor process never loads the engines it does not run
+    if options.get('engine', 'thread') == 'asyncio':
+        from openwebnet_async import OpenWebNetAsync
+        OpenWebNetAsync(options).run()
+    else:
+        from openwebnet import OpenWebNet
+        OpenWebNet(options).run()
+
+
+def gateway_options(options, gateway, index):
+    # Top level options are the defaults of every gateway, the gateway entry overrides them
+    name = str(gateway.get('name', index + 1))
+    worker_options = {key: value for key, value in options.items() if key != 'gateways'}
+    worker_options.update(gateway)
+    worker_options['name'] = name
+    worker_options['mqtt_client_name'] = f"{options['mqtt_client_name']}-{name}"
+    if 'mqtt_base_topic' not in gateway:
+        worker_options['mqtt_base_topic'] = f"{options['mqtt_base_topic']}/{name}"
+    # Files and ports can not be shared between processes
+    for section, key in (('state_snapshot', 'file'), ('capture', 'file'), ('state_journal', 'dir'),
+                         ('device_inventory', 'file')):
+        if worker_options.get(section, {}).get(key):
+            root, extension = os.path.splitext(worker_options[section][key])
+            worker_options[section] = dict(worker_options[section], **{key: f'{root}-{name}{extension}'})
+    if worker_options.get('metrics', {}).get('http_port'):
+        worker_options['metrics'] = dict(worker_options['metrics'], http_port=worker_options['metrics']['http_port'] + index)
+    return worker_options
+
+
+class OWNGatewayWorker:
+    def __init__(self, options, log_dir, context):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.name = options['name']
+        self.options = options
+        self.log_dir = log_dir
+        self.context = context
+        self.process = None
+        self.started_at = 0
+        self.next_start = 0
+        self.failures = 0
+
+    def check(self):
+        if self.process is not None:
+            if self.process.is_alive():
+                return
+            self.logger.info('Gateway %s worker exited with code %s', self.name, self.process.exitcode)
+            # A worker that ran for a while starts over, one that keeps dying backs off up to 5 minutes
+            self.failures = 0 if time.monotonic() - self.started_at > 300 else self.failures + 1
+            self.next_start = time.monotonic() + min(5 * 2 ** self.failures, 300)
+            self.process = None
+        if time.monotonic() >= self.next_start:
+            self.start()
+
+    def start(self):
+        self.logger.info('Starting gateway %s worker for %s:%s', self.name, self.options['own_server_ip'],
+                         self.options['own_server_port'])
+        self.process = self.context.Process(target=run_gateway, args=(self.options, self.log_dir, f'app-{self.name}'),
+                                            name=f'gateway-{self.name}', daemon=True)
+        self.process.start()
+        self.started_at = time.monotonic()
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(10)
+
+
+class OWNGatewaySupervisor:
+    def __init__(self, options, log_dir):
+        self.logger = logging.getLogger("own2mqtt")
+
+        # Spawned, not forked, so no worker inherits the supervisor's threads or log queue
+        context = multiprocessing.get_context('spawn')
+        self.workers = [OWNGatewayWorker(gateway_options(options, gateway, index), log_dir, context)
+                        for index, gateway in enumerate(options['gateways'])]
+        names = [worker.name for worker in self.workers]
+        if len(set(names)) != len(names):
+            raise ValueError(f'Gateway names must be unique: {names}')
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:
+                for worker in self.workers:
+                    worker.check()
+                time.sleep(1)
+        finally:
+            for worker in self.workers:
+                worker.stop()
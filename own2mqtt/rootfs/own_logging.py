@@ -0,0 +1,28 @@
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+
+def setup_logging(log_level, log_dir, log_name='app'):
+    logger = logging.getLogger("own2mqtt")
+    logger.setLevel(log_level)
+
+    logHandler = TimedRotatingFileHandler(filename=f"{log_dir}/{log_name}.log", when="midnight", interval=1, backupCount=5)
+    logFormatter = logging.Formatter('%(asctime)s %(levelname)-2s [%(filename)s:%(lineno)d] %(message)s')
+    logHandler.setFormatter(logFormatter)
+    logHandler.suffix = "%Y-%m-%d.log"
+    logHandler.extMatch = r"^\d{4}-\d{2}-\d{2}\.log$"
+
+    streamHandler = logging.StreamHandler(sys.stderr)
+    streamHandler.setFormatter(logFormatter)
+
+    # File and stderr I/O happen on the listener thread, the monitor and paho threads only enqueue records
+    logQueue = queue.SimpleQueue()
+    queueListener = QueueListener(logQueue, streamHandler, logHandler, respect_handler_level=True)
+    queueListener.start()
+    atexit.register(queueListener.stop)
+
+    logger.addHandler(QueueHandler(logQueue))
+    return logger
@@ -0,0 +1,138 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class OWNHistogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class OWNMetrics:
+    def __init__(self):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        # Callables returning {(name, ((label, value), ...)): value}, read at scrape time for values kept elsewhere
+        self.gauge_collectors = []
+        self.http_server = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = OWNHistogram()
+            histogram.observe(value)
+
+    def add_gauge_collector(self, collector):
+        self.gauge_collectors.append(collector)
+
+    def gauges(self):
+        gauges = {}
+        for collector in self.gauge_collectors:
+            gauges.update(collector())
+        return gauges
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+        self.__prometheus_values(lines, 'counter', counters)
+        self.__prometheus_values(lines, 'gauge', self.gauges())
+        typed = set()
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bucket, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{self.__labels(labels + (("le", bucket),))} {cumulative}')
+            lines.append(f'{name}_sum{self.__labels(labels)} {total}')
+            lines.append(f'{name}_count{self.__labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = {self.__key(key): value for key, value in self.counters.items()}
+            for key, histogram in self.histograms.items():
+                snapshot[self.__key(key)] = {'count': histogram.count,
+                                             'avg': histogram.sum / histogram.count if histogram.count else 0}
+        for key, value in self.gauges().items():
+            snapshot[self.__key(key)] = value
+        return snapshot
+
+    def start_http(self, port):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer(('', port), MetricsHandler)
+        threading.Thread(target=self.http_server.serve_forever, name='metrics-http', daemon=True).start()
+        self.logger.info('Metrics available on http://0.0.0.0:%s/metrics', port)
+
+    def start_mqtt(self, own_instance, interval):
+        def publish_loop():
+            while True:
+                time.sleep(interval)
+                if own_instance.mqtt_ready:
+                    own_instance.mqtt_client.publish(f'{own_instance.mqtt_base_topic}/metrics',
+                                                     payload=json.dumps(self.snapshot()), qos=0, retain=False)
+
+        threading.Thread(target=publish_loop, name='metrics-mqtt', daemon=True).start()
+
+    def __prometheus_values(self, lines, metric_type, values):
+        typed = set()
+        for (name, labels), value in sorted(values.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} {metric_type}')
+                typed.add(name)
+            lines.append(f'{name}{self.__labels(labels)} {value}')
+
+    @staticmethod
+    def __labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+    @staticmethod
+    def __key(key):
+        name, labels = key
+        return name + ''.join(f'.{value}' for _, value in labels)
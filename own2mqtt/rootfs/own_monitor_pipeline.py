@@ -0,0 +1,130 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+
+class OWNMonitorPipeline:
+    # MONITOR reader -> frame queue -> parser thread -> publish queue -> publisher thread
+    OVERFLOW_POLICIES = ('drop', 'block')
+
+    def __init__(self, own_instance, frame_queue_size=64, publish_queue_size=1024, batch_size=64, overflow='drop',
+                 stats_interval=60):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        self.batch_size = batch_size
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'Monitor pipeline overflow must be one of {self.OVERFLOW_POLICIES}: {overflow}')
+        # drop: a full frame queue loses its oldest socket read, the reader never waits.
+        # block: the reader waits for the parser, frames back up in the TCP receive buffer
+        self.overflow = overflow
+        self.stats_interval = stats_interval
+
+        # (frame monitor, frames) per socket read
+        self.frame_queue = queue.Queue(frame_queue_size)
+        # (topic, payload, qos, retain) for the state cache, the parser waits while it is full
+        self.publish_queue = queue.Queue(publish_queue_size)
+        self.lock = threading.Lock()
+        self.counters = {'frame_batches': 0, 'frames': 0, 'dropped_batches': 0, 'dropped_frames': 0,
+                         'publish_batches': 0, 'publishes': 0}
+        self.peak_depth = {'frame_queue': 0, 'publish_queue': 0}
+        self.next_stats = 0
+
+    def start(self):
+        threading.Thread(target=self.__parse_loop, name='monitor-parser', daemon=True).start()
+        threading.Thread(target=self.__publish_loop, name='monitor-publisher', daemon=True).start()
+
+    def submit(self, frame_monitor, frames):
+        # Called by the reader once per socket read
+        if self.overflow == 'block':
+            self.frame_queue.put((frame_monitor, frames))
+            return
+        while True:
+            try:
+                self.frame_queue.put_nowait((frame_monitor, frames))
+                return
+            except queue.Full:
+                pass
+            try:
+                _, dropped_frames = self.frame_queue.get_nowait()
+            except queue.Empty:
+                continue
+            with self.lock:
+                self.counters['dropped_batches'] += 1
+                self.counters['dropped_frames'] += len(dropped_frames)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        # Publisher of the frame monitors while the pipeline runs
+        self.publish_queue.put((topic, payload, qos, retain))
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, **{f'peak_{name}': depth for name, depth in self.peak_depth.items()})
+        stats['frame_queue'] = self.frame_queue.qsize()
+        stats['publish_queue'] = self.publish_queue.qsize()
+        return stats
+
+    def metrics_gauges(self):
+        return {('own2mqtt_monitor_pipeline_queue_depth', (('queue', 'frame'),)): self.frame_queue.qsize(),
+                ('own2mqtt_monitor_pipeline_queue_depth', (('queue', 'publish'),)): self.publish_queue.qsize(),
+                ('own2mqtt_monitor_pipeline_dropped_frames', ()): self.counters['dropped_frames']}
+
+    def __drain(self, source, name, timeout=None):
+        # Waits for the first item, then takes whatever else is already queued up to batch_size
+        try:
+            items = [source.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        depth = source.qsize() + 1
+        while len(items) < self.batch_size:
+            try:
+                items.append(source.get_nowait())
+            except queue.Empty:
+                break
+        with self.lock:
+            self.peak_depth[name] = max(self.peak_depth[name], depth)
+        return items
+
+    def __parse_loop(self):
+        while True:
+            batches = self.__drain(self.frame_queue, 'frame_queue', self.__stats_timeout())
+            frame_count = 0
+            for frame_monitor, frames in batches:
+                for frame in frames:
+                    try:
+                        self.own_instance.handle_monitor_frame(frame_monitor, frame)
+                    except Exception as e:
+                        self.logger.info(e)
+                frame_count += len(frames)
+            with self.lock:
+                self.counters['frame_batches'] += len(batches)
+                self.counters['frames'] += frame_count
+            self.__publish_stats()
+
+    def __publish_loop(self):
+        state_cache = self.own_instance.state_cache
+        while True:
+            publishes = self.__drain(self.publish_queue, 'publish_queue')
+            for topic, payload, qos, retain in publishes:
+                try:
+                    state_cache.publish(topic, payload=payload, qos=qos, retain=retain)
+                except Exception as e:
+                    self.logger.info(e)
+            with self.lock:
+                self.counters['publish_batches'] += 1
+                self.counters['publishes'] += len(publishes)
+
+    def __stats_timeout(self):
+        if self.stats_interval <= 0:
+            return None
+        return max(self.next_stats - time.monotonic(), 0.1)
+
+    def __publish_stats(self):
+        if self.stats_interval <= 0 or time.monotonic() < self.next_stats:
+            return
+        self.next_stats = time.monotonic() + self.stats_interval
+        if self.own_instance.mqtt_ready:
+            self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/monitor/pipeline',
+                                                  payload=json.dumps(self.stats()), qos=0, retain=False)
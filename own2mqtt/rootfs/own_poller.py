@@ -0,0 +1,88 @@
+import heapq
+import logging
+import random
+import threading
+import time
+
+
+class OWNPollJob:
+    __slots__ = ('name', 'frames', 'interval', 'jitter', 'due')
+
+    def __init__(self, name, frames, interval, jitter, due):
+        self.name = name
+        self.frames = frames
+        self.interval = interval
+        self.jitter = jitter
+        self.due = due
+
+    def reschedule(self, now):
+        # Random extra delay so jobs with the same interval drift apart instead of bursting together
+        self.due = now + self.interval + random.uniform(0, self.interval * self.jitter)
+
+
+class OWNPoller:
+    def __init__(self, jitter=0.1):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.jitter = jitter
+        self.jobs = {}
+        self.heap = []
+        self.counter = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def add_job(self, name, frames, interval, run_now=False):
+        if interval <= 0:
+            return
+        now = time.monotonic()
+        due = now if run_now else now + random.uniform(0, interval)
+        job = OWNPollJob(name, frames, interval, self.jitter, due)
+        with self.condition:
+            self.jobs[name] = job
+            self.__push(job)
+            self.condition.notify()
+
+    def next_delay(self):
+        with self.condition:
+            if not self.heap:
+                return None
+            return max(self.heap[0][0] - time.monotonic(), 0)
+
+    def pop_due(self):
+        frames = []
+        now = time.monotonic()
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                due, _, job = heapq.heappop(self.heap)
+                # Entries of replaced jobs stay in the heap until they are popped
+                if self.jobs.get(job.name) is not job or job.due != due:
+                    continue
+                frames.extend(job.frames)
+                job.reschedule(now)
+                self.__push(job)
+        return frames
+
+    def start(self, submit):
+        self.thread = threading.Thread(target=self.__run, args=(submit,), name='poller', daemon=True)
+        self.thread.start()
+
+    def schedule(self):
+        now = time.monotonic()
+        with self.condition:
+            jobs = sorted(self.jobs.values(), key=lambda job: job.due)
+            return {
+                'frames_per_hour': round(sum(len(job.frames) * 3600 / job.interval for job in jobs)),
+                'jobs': [{'name': job.name, 'interval': job.interval, 'frames': len(job.frames),
+                          'next_in': round(max(job.due - now, 0), 1)} for job in jobs],
+            }
+
+    def __push(self, job):
+        self.counter += 1
+        heapq.heappush(self.heap, (job.due, self.counter, job))
+
+    def __run(self, submit):
+        while True:
+            with self.condition:
+                self.condition.wait(self.next_delay())
+            for encoded_frame in self.pop_due():
+                submit(encoded_frame)
@@ -0,0 +1,194 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import own_command_channel
+from own_bulk_command import OWNBulkCommand
+from own_command_pool import OWNCommandSession
+from own_frame_command import OWNFrameCommand
+
+
+# Relative to mqtt_base_topic
+PROFILER_COMMAND_TOPIC = 'profiler/command'
+PROFILER_RESULT_TOPIC = 'profiler/result'
+
+
+def profiled_targets(own_instance):
+    # (owner, attribute) wrapped with a per-thread cProfile while a cpu run lasts, where the work actually runs:
+    # monitor frames on the reader or parser thread, command parsing and building on paho's callback thread,
+    # socket I/O on the scheduler, pool and channel reader threads, publishing on the monitor pipeline publisher
+    targets = [(own_instance, 'handle_monitor_frame'), (own_instance, 'execute_command'), (own_instance, 'write_socket'),
+               (own_instance.state_cache, 'publish'), (OWNFrameCommand, '__init__'), (OWNFrameCommand, 'on_response'),
+               (OWNBulkCommand, '__init__'), (OWNBulkCommand, 'on_response'), (OWNCommandSession, 'send'),
+               (own_command_channel, 'correlate_response')]
+    # The asyncio engine imported its own reference to the function
+    if 'openwebnet_async' in sys.modules:
+        targets.append((sys.modules['openwebnet_async'], 'correlate_response'))
+    return targets
+
+
+class OWNProfiler:
+    def __init__(self, own_instance, output_dir='/addons/own2mqtt/log', max_seconds=300):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        self.output_dir = output_dir
+        self.max_seconds = max_seconds
+        # One run at a time, cpu and sample runs both slow the add-on down
+        self.busy = threading.Lock()
+        self.memory_snapshot = None
+
+    def handle(self, payload):
+        # {"action": "cpu" | "sample" | "memory" | "memory_stop", "seconds": 30, "top": 20, "interval": 0.01}
+        try:
+            request = json.loads(payload or b'{}')
+            action = request.get('action', 'sample')
+            seconds = min(float(request.get('seconds', 30)), self.max_seconds)
+            top = int(request.get('top', 20))
+            interval = float(request.get('interval', 0.01))
+        except (ValueError, AttributeError) as e:
+            self.publish_result({'error': f'Invalid profiler command: {e}'})
+            return
+        if action == 'memory_stop':
+            tracemalloc.stop()
+            self.memory_snapshot = None
+            self.publish_result({'action': action})
+        elif action in ('cpu', 'sample', 'memory'):
+            # Runs on its own thread, a snapshot of a large heap must not stall the MQTT network loop
+            if not self.busy.acquire(blocking=False):
+                self.publish_result({'action': action, 'error': 'A profiler run is already in progress'})
+                return
+            run = {'cpu': self.cpu, 'sample': self.sample, 'memory': self.memory}[action]
+            threading.Thread(target=self.run, args=(run, seconds, top, interval), name='profiler', daemon=True).start()
+        else:
+            self.publish_result({'error': f'Unknown profiler action {action}'})
+
+    def run(self, run, seconds, top, interval):
+        try:
+            self.publish_result(run(seconds, top, interval))
+        except Exception as e:
+            self.logger.info(e)
+            self.publish_result({'error': str(e)})
+        finally:
+            self.busy.release()
+
+    def cpu(self, seconds, top, interval):
+        # cProfile only sees the thread it is enabled in, so every thread entering a wrapped method gets its own
+        profiles = {}
+        lock = threading.Lock()
+        active = threading.local()
+
+        def wrap(method):
+            def profiled(*args, **kwargs):
+                # A nested entry point (execute_command -> write_socket) is already covered by the outer one
+                if getattr(active, 'profile', None):
+                    return method(*args, **kwargs)
+                thread_id = threading.get_ident()
+                profile = profiles.get(thread_id)
+                if profile is None:
+                    with lock:
+                        profile = profiles[thread_id] = cProfile.Profile()
+                active.profile = profile
+                try:
+                    return profile.runcall(method, *args, **kwargs)
+                finally:
+                    active.profile = None
+            return profiled
+
+        # Instance attributes shadow the methods, the engines call them through self. Classes and modules get their
+        # own attribute back at the end
+        targets = profiled_targets(self.own_instance)
+        originals = [vars(owner).get(name) for owner, name in targets]
+        for owner, name in targets:
+            setattr(owner, name, wrap(getattr(owner, name)))
+        try:
+            time.sleep(seconds)
+        finally:
+            for (owner, name), original in zip(targets, originals):
+                if original is None:
+                    delattr(owner, name)
+                else:
+                    setattr(owner, name, original)
+        with lock:
+            profiles = list(profiles.values())
+        result = {'action': 'cpu', 'seconds': seconds, 'threads': len(profiles), 'top': [],
+                  'covers': [f'{getattr(owner, "__name__", type(owner).__name__)}.{name}' for owner, name in targets]}
+        if not profiles:
+            return result
+        stats = pstats.Stats(profiles[0], stream=io.StringIO())
+        for profile in profiles[1:]:
+            stats.add(profile)
+        result['file'] = self.output_path('cpu', 'prof')
+        stats.dump_stats(result['file'])
+        stats.sort_stats('cumulative')
+        for function in stats.fcn_list[:top]:
+            calls, _, total_time, cumulative_time, _ = stats.stats[function]
+            result['top'].append({'function': pstats.func_std_string(function), 'calls': calls,
+                                  'tottime': round(total_time, 6), 'cumtime': round(cumulative_time, 6)})
+        return result
+
+    def sample(self, seconds, top, interval):
+        # Stack samples of every thread, paho's network thread included, written as collapsed stacks
+        own_thread = threading.get_ident()
+        stacks = Counter()
+        functions = Counter()
+        samples = 0
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.reverse()
+                stacks[';'.join([names.get(thread_id, str(thread_id))] + stack)] += 1
+                functions[stack[-1]] += 1
+            samples += 1
+            time.sleep(interval)
+        file = self.output_path('sample', 'folded')
+        with open(file, 'w') as folded_file:
+            for stack, count in stacks.most_common():
+                folded_file.write(f'{stack} {count}\n')
+        return {'action': 'sample', 'seconds': seconds, 'samples': samples, 'file': file,
+                'top': [{'function': function, 'samples': count} for function, count in functions.most_common(top)]}
+
+    def memory(self, seconds, top, interval):
+        # The first call starts tracing, every later one is compared to the snapshot taken before it
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self.memory_snapshot = tracemalloc.take_snapshot()
+            return {'action': 'memory', 'tracing': True}
+        snapshot = tracemalloc.take_snapshot()
+        statistics = snapshot.compare_to(self.memory_snapshot, 'lineno') if self.memory_snapshot else \
+            snapshot.statistics('lineno')
+        self.memory_snapshot = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        file = self.output_path('memory', 'txt')
+        with open(file, 'w') as memory_file:
+            for statistic in statistics:
+                memory_file.write(f'{statistic}\n')
+        return {'action': 'memory', 'current_bytes': current, 'peak_bytes': peak, 'file': file,
+                'top': [str(statistic) for statistic in statistics[:top]]}
+
+    def output_path(self, kind, extension):
+        os.makedirs(self.output_dir, exist_ok=True)
+        # The client name keeps the files of several gateway workers apart
+        name = f"{kind}-{self.own_instance.mqtt_client_name}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}"
+        return os.path.join(self.output_dir, name)
+
+    def publish_result(self, result):
+        self.logger.info('Profiler: %s', result.get('file', result.get('error', result.get('action'))))
+        self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/{PROFILER_RESULT_TOPIC}',
+                                              payload=json.dumps(result), qos=0, retain=False)
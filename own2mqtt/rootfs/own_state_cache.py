@@ -0,0 +1,114 @@
+import threading
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+
+class OWNStateCache:
+    # Topic classes checked in order, the first matching filter wins (filters are relative to mqtt_base_topic)
+    TOPIC_CLASSES = (
+        ('event', 'who-25/#'),
+        ('event', 'who-1/+/presence'),
+        ('event', 'who-13/#'),
+        ('energy', 'who-18/#'),
+        ('state', '#'),
+    )
+
+    def __init__(self, own_instance, enabled=True, state_max_age=0, energy_max_age=300, snapshot=None, journal=None):
+        self.own_instance = own_instance
+        self.enabled = enabled
+        # Retained values are also recorded in the on-disk snapshot, even when unchanged, to keep them fresh
+        self.snapshot = snapshot
+        # Retained values that differ from the last one seen are appended to the state journal
+        self.journal = journal
+        # max_age in seconds before an unchanged value is published again, 0 never refreshes, None always publishes
+        self.max_age = {'event': None, 'energy': energy_max_age, 'state': state_max_age}
+        self.base_topic_length = len(own_instance.mqtt_base_topic) + 1
+
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.topic_class = {}
+        # Retained topic -> (encoded payload, last time it was seen), whether published again or not
+        self.values = {}
+        self.published = 0
+        self.suppressed = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        max_age = self.max_age[self.__topic_class(topic)] if self.enabled else None
+        if max_age is None:
+            if retain:
+                self.__record(topic, self.__encode(payload))
+            self.published += 1
+            return self.own_instance.mqtt_client.publish(topic, payload=payload, qos=qos, retain=retain)
+
+        encoded_payload = self.__encode(payload)
+        if retain and self.snapshot is not None:
+            self.snapshot.record(topic, encoded_payload)
+        now = time.monotonic()
+        changed = False
+        with self.lock:
+            if retain:
+                previous = self.values.get(topic)
+                changed = previous is None or previous[0] != encoded_payload
+                self.values[topic] = (encoded_payload, now)
+            entry = self.entries.get(topic)
+            if entry and entry[0] == encoded_payload and (max_age == 0 or now - entry[1] < max_age):
+                self.suppressed += 1
+                return None
+            self.entries[topic] = (encoded_payload, now)
+            self.published += 1
+            if changed and self.journal is not None:
+                self.journal.record(topic, encoded_payload)
+            return self.own_instance.mqtt_client.publish(topic, payload=payload, qos=qos, retain=retain)
+
+    def restore(self, topic, encoded_payload):
+        # Warm start from the snapshot, published and cached but not recorded again
+        with self.lock:
+            self.entries[topic] = self.values[topic] = (encoded_payload, time.monotonic())
+            self.published += 1
+        return self.own_instance.mqtt_client.publish(topic, payload=encoded_payload, qos=1, retain=True)
+
+    def get(self, topic):
+        entry = self.entries.get(topic)
+        return entry[0] if entry else None
+
+    def values_under(self, prefix):
+        # The retained values of a device or WHO, prefix is an absolute topic
+        with self.lock:
+            return {topic: value for topic, value in self.values.items()
+                    if topic.startswith(prefix) and (len(topic) == len(prefix) or topic[len(prefix)] == '/')}
+
+    def clear(self):
+        # After a broker reconnect everything is published once again, the known values stay
+        with self.lock:
+            self.entries.clear()
+
+    def __record(self, topic, encoded_payload):
+        if self.snapshot is not None:
+            self.snapshot.record(topic, encoded_payload)
+        with self.lock:
+            previous = self.values.get(topic)
+            self.values[topic] = (encoded_payload, time.monotonic())
+        if self.journal is not None and (previous is None or previous[0] != encoded_payload):
+            self.journal.record(topic, encoded_payload)
+
+    def __topic_class(self, topic):
+        topic_class = self.topic_class.get(topic)
+        if topic_class is None:
+            relative_topic = topic[self.base_topic_length:]
+            for topic_class, topic_filter in self.TOPIC_CLASSES:
+                if topic_matches_sub(topic_filter, relative_topic):
+                    break
+            self.topic_class[topic] = topic_class
+        return topic_class
+
+    @staticmethod
+    def __encode(payload):
+        # Same normalization paho applies, so b'ON' and 'ON' are the same value
+        if isinstance(payload, (bytes, bytearray)):
+            return bytes(payload)
+        if isinstance(payload, str):
+            return payload.encode()
+        if payload is None:
+            return b''
+        return str(payload).encode()
@@ -0,0 +1,278 @@
+import bisect
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+from paho.mqtt.client import topic_matches_sub
+
+
+# Relative to mqtt_base_topic
+HISTORY_QUERY_TOPIC = 'history/query'
+HISTORY_RESULT_TOPIC = 'history/result'
+
+# Record header: epoch seconds, topic length, payload length, followed by the topic (relative to mqtt_base_topic)
+# and the payload, both as bytes
+RECORD = struct.Struct('<dHH')
+
+
+class OWNJournalSegment:
+    __slots__ = ('number', 'path', 'size', 'first_time', 'last_time')
+
+    def __init__(self, number, path, size=0):
+        self.number = number
+        self.path = path
+        self.size = size
+        self.first_time = None
+        self.last_time = None
+
+
+class OWNStateJournal:
+    # Append-only segments of state changes, an in-memory index per topic and segment
+    # of (times, offsets) so a time range is two bisects away
+    def __init__(self, own_instance, directory, segment_size_mb=4, retention_days=30, max_size_mb=256,
+                 exclude=('who-18/#',), flush_interval=5):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        self.directory = directory
+        self.segment_size = segment_size_mb * 1024 * 1024
+        self.retention = retention_days * 86400
+        self.max_size = max_size_mb * 1024 * 1024
+        self.exclude = tuple(exclude)
+        self.flush_interval = flush_interval
+        self.base_topic_length = len(own_instance.mqtt_base_topic) + 1
+
+        self.lock = threading.Lock()
+        self.segments = []
+        # Relative topic -> {segment number: (times array('d'), offsets array('I'))}
+        self.index = {}
+        # Relative topic -> journaled or not, from the exclude filters
+        self.included = {}
+        self.pending = bytearray()
+        self.file = None
+        self.load()
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        started = time.monotonic()
+        records = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, 'journal-*.seg'))):
+            segment = OWNJournalSegment(int(os.path.basename(path)[8:-4]), path)
+            records += self.__load_segment(segment)
+            self.segments.append(segment)
+        with self.lock:
+            self.__expire()
+            if not self.segments:
+                self.__new_segment(1)
+            self.file = open(self.segments[-1].path, 'ab')
+        self.logger.info('State journal %s: %s records in %s segments, indexed in %.2f s', self.directory, records,
+                         len(self.segments), time.monotonic() - started)
+
+    def record(self, topic, encoded_payload):
+        relative_topic = topic[self.base_topic_length:]
+        included = self.included.get(relative_topic)
+        if included is None:
+            included = self.included[relative_topic] = not any(topic_matches_sub(topic_filter, relative_topic)
+                                                               for topic_filter in self.exclude)
+        if not included:
+            return
+        now = time.time()
+        encoded_topic = relative_topic.encode()
+        record = RECORD.pack(now, len(encoded_topic), len(encoded_payload)) + encoded_topic + encoded_payload
+        with self.lock:
+            segment = self.segments[-1]
+            if segment.size and segment.size + len(record) > self.segment_size:
+                self.__write_pending()
+                self.__new_segment(segment.number + 1)
+                self.__expire()
+                segment = self.segments[-1]
+            self.__add(segment, relative_topic, now, segment.size)
+            segment.size += len(record)
+            self.pending += record
+
+    def start(self):
+        def flush_loop():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+                self.expire()
+
+        threading.Thread(target=flush_loop, name='state-journal', daemon=True).start()
+
+    def flush(self):
+        with self.lock:
+            self.__write_pending()
+
+    def expire(self):
+        # A quiet bus takes weeks to fill a segment, so the active one is also closed once its oldest record
+        # is past the retention, and deleted with the others once its last one is
+        with self.lock:
+            segment = self.segments[-1]
+            if segment.first_time is not None and segment.first_time < time.time() - self.retention:
+                self.__write_pending()
+                self.__new_segment(segment.number + 1)
+            self.__expire()
+
+    def query(self, prefix, since, until, limit=1000):
+        # Changes of the topic or device prefix (relative to mqtt_base_topic) in [since, until], oldest first.
+        # Records past the retention may still sit in a segment with newer ones, they are never returned
+        since = max(since, time.time() - self.retention)
+        self.flush()
+        matches = []
+        with self.lock:
+            segments = {segment.number: segment for segment in self.segments}
+            for topic, topic_segments in self.index.items():
+                if topic != prefix and not topic.startswith(prefix + '/'):
+                    continue
+                for number, (times, offsets) in topic_segments.items():
+                    start = bisect.bisect_left(times, since)
+                    end = bisect.bisect_right(times, until)
+                    matches.extend((times[position], number, offsets[position]) for position in range(start, end))
+        matches.sort()
+        truncated = len(matches) > limit
+        matches = matches[:limit]
+        entries = []
+        mapped = {}
+        try:
+            for timestamp, number, offset in matches:
+                segment_map = mapped.get(number)
+                if segment_map is None:
+                    with open(segments[number].path, 'rb') as segment_file:
+                        segment_map = mapped[number] = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+                _, topic_length, payload_length = RECORD.unpack_from(segment_map, offset)
+                start = offset + RECORD.size
+                if start + topic_length + payload_length > len(segment_map):
+                    continue
+                entries.append([round(timestamp, 3), segment_map[start:start + topic_length].decode(),
+                                segment_map[start + topic_length:start + topic_length + payload_length].decode(errors='replace')])
+        finally:
+            for segment_map in mapped.values():
+                segment_map.close()
+        return entries, truncated
+
+    def handle_query(self, payload):
+        # {"device": "who-2/41", "from": epoch, "to": epoch, "limit": 1000, "id": ...}, "last": seconds instead of from
+        try:
+            request = json.loads(payload)
+            now = time.time()
+            until = float(request.get('to', now))
+            since = float(request['from']) if 'from' in request else until - float(request.get('last', 86400))
+            result = {'id': request.get('id'), 'device': request['device']}
+            entries, truncated = self.query(request['device'].strip('/'), since, until, int(request.get('limit', 1000)))
+            result.update(entries=entries, truncated=truncated)
+        except (ValueError, KeyError, TypeError, AttributeError, OSError, struct.error) as e:
+            result = {'error': f'Invalid history query: {e}'}
+        self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/{HISTORY_RESULT_TOPIC}',
+                                              payload=json.dumps(result), qos=0, retain=False)
+
+    def __load_segment(self, segment):
+        size = os.path.getsize(segment.path)
+        offset = 0
+        records = 0
+        if size:
+            topics = {}
+            with open(segment.path, 'rb') as segment_file:
+                segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    while offset + RECORD.size <= size:
+                        timestamp, topic_length, payload_length = RECORD.unpack_from(segment_map, offset)
+                        end = offset + RECORD.size + topic_length + payload_length
+                        if end > size:
+                            break
+                        encoded_topic = segment_map[offset + RECORD.size:offset + RECORD.size + topic_length]
+                        topic = topics.get(encoded_topic)
+                        if topic is None:
+                            topic = topics[encoded_topic] = encoded_topic.decode()
+                        self.__add(segment, topic, timestamp, offset)
+                        offset = end
+                        records += 1
+                finally:
+                    segment_map.close()
+        if offset < size:
+            # A record cut by a crash, the segment continues from the last complete one
+            self.logger.info('State journal %s: dropping %s bytes of a partial record', segment.path, size - offset)
+            os.truncate(segment.path, offset)
+        segment.size = offset
+        return records
+
+    def __add(self, segment, topic, timestamp, offset):
+        topic_segments = self.index.get(topic)
+        if topic_segments is None:
+            topic_segments = self.index[topic] = {}
+        entry = topic_segments.get(segment.number)
+        if entry is None:
+            entry = topic_segments[segment.number] = (array('d'), array('I'))
+        entry[0].append(timestamp)
+        entry[1].append(offset)
+        if segment.first_time is None:
+            segment.first_time = timestamp
+        segment.last_time = timestamp
+
+    def __write_pending(self):
+        if not self.pending:
+            return
+        try:
+            self.file.write(self.pending)
+            self.file.flush()
+        except (OSError, ValueError) as e:
+            self.logger.info('State journal %s: %s', self.directory, e)
+            # The records are lost, so are their index entries, the segment continues from the last written one
+            segment = self.segments[-1]
+            self.__rollback(segment, segment.size - len(self.pending))
+        self.pending = bytearray()
+
+    def __rollback(self, segment, size):
+        try:
+            self.file.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(segment.path, size)
+            size = os.path.getsize(segment.path)
+            self.file = open(segment.path, 'ab')
+        except OSError as e:
+            self.logger.info('State journal %s: %s', segment.path, e)
+        segment.size = size
+        segment.last_time = None
+        for topic_segments in self.index.values():
+            entry = topic_segments.get(segment.number)
+            if entry is None:
+                continue
+            times, offsets = entry
+            kept = bisect.bisect_left(offsets, size)
+            del times[kept:]
+            del offsets[kept:]
+            if times:
+                segment.last_time = max(segment.last_time or times[-1], times[-1])
+        if segment.last_time is None:
+            segment.first_time = None
+
+    def __new_segment(self, number):
+        if self.file:
+            self.file.close()
+        segment = OWNJournalSegment(number, os.path.join(self.directory, f'journal-{number:06d}.seg'))
+        self.segments.append(segment)
+        self.file = open(segment.path, 'ab')
+
+    def __expire(self):
+        # Oldest segments go first, past the retention or the size limit, the active one always stays
+        oldest = time.time() - self.retention
+        total_size = sum(segment.size for segment in self.segments)
+        while len(self.segments) > 1:
+            segment = self.segments[0]
+            if segment.last_time is not None and segment.last_time >= oldest and total_size <= self.max_size:
+                break
+            self.segments.pop(0)
+            total_size -= segment.size
+            for topic_segments in self.index.values():
+                topic_segments.pop(segment.number, None)
+            try:
+                os.remove(segment.path)
+            except OSError as e:
+                self.logger.info('State journal %s: %s', segment.path, e)
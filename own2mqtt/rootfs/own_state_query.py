@@ -0,0 +1,98 @@
+import json
+import logging
+import threading
+import time
+
+from own_frame_monitor import OWNFrameMonitor
+
+
+# Relative to mqtt_base_topic: who-1/get, who-1/12/get, who-4/zones/3/get
+STATE_QUERY_TOPICS = ('+/get', '+/+/get', '+/+/+/get')
+
+
+class OWNStateQuery:
+    def __init__(self, own_instance, ttl=60, timeout=5):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.own_instance = own_instance
+        self.ttl = ttl
+        self.timeout = timeout
+        self.base_topic_length = len(own_instance.mqtt_base_topic) + 1
+        # Status answers read on the command session update the state cache like monitor frames
+        self.frame_monitor = OWNFrameMonitor(own_instance)
+
+        self.lock = threading.Lock()
+        # Relative device prefix -> request in progress, later gets for the same prefix wait for its answer
+        self.pending = {}
+
+    def topic_filters(self):
+        return [f'{self.own_instance.mqtt_base_topic}/{topic_filter}' for topic_filter in STATE_QUERY_TOPICS]
+
+    def handle(self, topic):
+        prefix = topic[self.base_topic_length:-len('/get')]
+        values = self.own_instance.state_cache.values_under(f'{self.own_instance.mqtt_base_topic}/{prefix}')
+        now = time.monotonic()
+        frames = self.request_frames(prefix)
+        if not frames or values and all(now - seen < self.ttl for _, seen in values.values()):
+            self.own_instance.metrics.inc('own2mqtt_state_queries_total', result='cache')
+            self.reply(prefix, 'cache')
+            return
+        with self.lock:
+            if prefix in self.pending:
+                self.own_instance.metrics.inc('own2mqtt_state_queries_total', result='deduplicated')
+                return
+            # [status requests still unanswered], the timer only completes the request it was started for
+            request = self.pending[prefix] = [len(frames)]
+        self.own_instance.metrics.inc('own2mqtt_state_queries_total', result='gateway')
+        timer = threading.Timer(self.timeout, self.complete, (prefix, request, 'timeout'))
+        timer.daemon = True
+        timer.start()
+        for encoded_frame in frames:
+            self.own_instance.submit_status_query(encoded_frame, lambda future: self.on_response(prefix, request, future))
+
+    def request_frames(self, prefix):
+        # Status requests that refresh every value under the prefix, none for event-only or unknown devices
+        own_instance = self.own_instance
+        parts = prefix.split('/')
+        who = parts[0]
+        if who in ('who-1', 'who-2') and len(parts) <= 2:
+            where = parts[1] if len(parts) == 2 else '0'
+            return [f'*#{who[4:]}*{where}##'.encode()]
+        if who == 'who-4':
+            if len(parts) == 1:
+                return [frame for thermo_zone in own_instance.thermo_zones for frame in own_instance.thermo_zone_frames(thermo_zone)]
+            if len(parts) == 3 and parts[1] == 'zones':
+                return own_instance.thermo_zone_frames(parts[2])
+        if who == 'who-18':
+            if len(parts) == 1:
+                return [frame for f520_id in own_instance.f520_ids for frame in own_instance.total_energy_frames(f520_id)]
+            if len(parts) == 2 and parts[1].startswith('5'):
+                return own_instance.total_energy_frames(parts[1][1:])
+        return []
+
+    def on_response(self, prefix, request, future):
+        if not future.cancelled() and not future.exception():
+            for frame in future.result():
+                if frame not in (self.own_instance.ACK.decode(), self.own_instance.NACK.decode()):
+                    self.frame_monitor.read_frame(frame)
+        with self.lock:
+            request[0] -= 1
+            if request[0] > 0:
+                return
+        self.complete(prefix, request, 'gateway')
+
+    def complete(self, prefix, request, source):
+        with self.lock:
+            if self.pending.get(prefix) is not request:
+                return
+            del self.pending[prefix]
+        self.reply(prefix, source)
+
+    def reply(self, prefix, source):
+        now = time.monotonic()
+        values = self.own_instance.state_cache.values_under(f'{self.own_instance.mqtt_base_topic}/{prefix}')
+        result = {'source': source,
+                  'values': {topic[self.base_topic_length:]: payload.decode() for topic, (payload, _) in values.items()},
+                  'age': round(max((now - seen for _, seen in values.values()), default=0), 1)}
+        self.own_instance.mqtt_client.publish(f'{self.own_instance.mqtt_base_topic}/{prefix}/get/result',
+                                              payload=json.dumps(result), qos=0, retain=False)
@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+
+class OWNStateSnapshot:
+    # One JSON line per change: [topic relative to mqtt_base_topic, payload, epoch seconds], the last line of a topic wins.
+    # The file is compacted on load and whenever it grows past compact_ratio times the number of topics.
+    def __init__(self, own_instance, path, max_age=900, flush_interval=5, compact_ratio=4):
+        self.logger = logging.getLogger("own2mqtt")
+
+        self.path = path
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.compact_ratio = compact_ratio
+        self.base_topic = own_instance.mqtt_base_topic
+        self.base_topic_length = len(self.base_topic) + 1
+
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = {}
+        self.lines = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as snapshot_file:
+                for line in snapshot_file:
+                    try:
+                        topic, payload, updated = json.loads(line)
+                    except ValueError:
+                        # A line cut by a crash, everything before it is still good
+                        continue
+                    self.entries[topic] = (payload.encode(), updated)
+        except FileNotFoundError:
+            pass
+        self.logger.info('State snapshot %s: %s entries, %s fresh', self.path, len(self.entries), len(self.fresh_entries()))
+        self.compact()
+
+    def record(self, topic, encoded_payload):
+        now = time.time()
+        relative_topic = topic[self.base_topic_length:]
+        with self.lock:
+            entry = self.entries.get(relative_topic)
+            # An unchanged value is only written again once it is getting old, to keep it fresh at the next start
+            if entry and entry[0] == encoded_payload and now - entry[1] < self.max_age / 4:
+                return
+            self.entries[relative_topic] = self.dirty[relative_topic] = (encoded_payload, now)
+
+    def fresh(self, topic_filter):
+        # topic_filter is relative to mqtt_base_topic and may contain wildcards: fresh when it matches something
+        # and every matching value is fresh, one stale light is enough to query them all again
+        oldest = time.time() - self.max_age
+        with self.lock:
+            updates = [updated for topic, (_, updated) in self.entries.items() if topic_matches_sub(topic_filter, topic)]
+        return bool(updates) and min(updates) >= oldest
+
+    def fresh_entries(self):
+        oldest = time.time() - self.max_age
+        with self.lock:
+            return [(f'{self.base_topic}/{topic}', payload) for topic, (payload, updated) in self.entries.items()
+                    if updated >= oldest]
+
+    def start(self):
+        def flush_loop():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+
+        threading.Thread(target=flush_loop, name='state-snapshot', daemon=True).start()
+
+    def flush(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            compact = self.lines + len(dirty) > self.compact_ratio * max(len(self.entries), 100)
+        if compact:
+            self.compact()
+            return
+        if not dirty:
+            return
+        try:
+            with open(self.path, 'a', encoding='utf-8') as snapshot_file:
+                snapshot_file.writelines(self.__line(topic, entry) for topic, entry in dirty.items())
+            self.lines += len(dirty)
+        except OSError as e:
+            self.logger.info('State snapshot %s: %s', self.path, e)
+
+    def compact(self):
+        with self.lock:
+            entries = dict(self.entries)
+            self.dirty.clear()
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # Write aside and rename, a crash never leaves a half written snapshot behind
+            with open(f'{self.path}.tmp', 'w', encoding='utf-8') as snapshot_file:
+                snapshot_file.writelines(self.__line(topic, entry) for topic, entry in entries.items())
+            os.replace(f'{self.path}.tmp', self.path)
+            self.lines = len(entries)
+        except OSError as e:
+            self.logger.info('State snapshot %s: %s', self.path, e)
+
+    @staticmethod
+    def __line(topic, entry):
+        payload, updated = entry
+        return json.dumps([topic, payload.decode(errors='replace'), round(updated, 1)], separators=(',', ':')) + '\n'
@@ -0,0 +1,85 @@
+import argparse, cProfile, json, logging, pstats, sys, time
+from openwebnet import OpenWebNet
+from own_frame_capture import read_capture
+
+
+class NullMQTTClient:
+    def __init__(self):
+        self.publish_count = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.publish_count += 1
+
+
+parser = argparse.ArgumentParser(description='Replay a MONITOR frame capture through OWNFrameMonitor')
+parser.add_argument('options_path')
+parser.add_argument('capture_path')
+parser.add_argument('--speed', type=float, default=1, help='1 = real time, N = N times faster, 0 = as fast as possible')
+parser.add_argument('--no-mqtt', action='store_true', help='count publishes instead of sending them to the broker')
+parser.add_argument('--profile', action='store_true', help='print the cProfile top functions at the end')
+args = parser.parse_args()
+
+with open(args.options_path) as json_file:
+    options = json.load(json_file)
+
+logging.basicConfig(format='%(asctime)s %(levelname)-2s [%(filename)s:%(lineno)d] %(message)s', stream=sys.stderr)
+logger = logging.getLogger("own2mqtt")
+logger.setLevel(options['log_level'])
+
+# The live snapshot and journal are left alone: loading them compacts, truncates and expires files the running
+# add-on has open, and replayed states would be recorded with the current time
+options['state_snapshot'] = {}
+options['state_journal'] = {}
+own_instance = OpenWebNet(options)
+own_instance.state_snapshot = own_instance.state_cache.snapshot = None
+own_instance.state_journal = own_instance.state_cache.journal = None
+# Never capture while replaying, the options may point at the very file being replayed
+own_instance.capture_file = ''
+# Frames are handled inline, so the timings and publish counts cover the whole frame path
+own_instance.monitor_pipeline = None
+own_instance.device_inventory = None
+if args.no_mqtt:
+    own_instance.mqtt_client = NullMQTTClient()
+    own_instance.mqtt_ready = True
+else:
+    # Publish only, under its own client id: the broker would disconnect the running add-on on a shared id,
+    # and its command, query and profiler subscriptions would make the replay act on live requests
+    own_instance.mqtt_client_name = f"{options['mqtt_client_name']}-replay"
+
+    def on_replay_mqtt_connect(client, userdata, flags, rc):
+        own_instance.mqtt_ready = True
+
+    own_instance.on_mqtt_connect = on_replay_mqtt_connect
+    own_instance.mqtt_start()
+    while not own_instance.mqtt_ready:
+        time.sleep(0.1)
+
+frame_monitor = own_instance.create_frame_monitor()
+profiler = cProfile.Profile() if args.profile else None
+if profiler:
+    profiler.enable()
+
+frames = 0
+capture_time = 0
+start = time.monotonic()
+for delay, frame in read_capture(args.capture_path):
+    if args.speed > 0:
+        # Pace against the capture clock instead of sleeping per frame, so sleep jitter does not accumulate
+        capture_time += delay
+        lag = start + capture_time / args.speed - time.monotonic()
+        if lag > 0:
+            time.sleep(lag)
+    own_instance.handle_monitor_frame(frame_monitor, frame)
+    frames += 1
+elapsed = time.monotonic() - start
+
+if profiler:
+    profiler.disable()
+    pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+
+logger.warning('Replayed %s frames in %.3f s (%.0f frames/s)', frames, elapsed, frames / elapsed if elapsed else 0)
+if args.no_mqtt:
+    logger.warning('%s MQTT publishes', own_instance.mqtt_client.publish_count)
+else:
+    own_instance.mqtt_client.loop_stop()
+    own_instance.mqtt_client.disconnect()